@@ -0,0 +1,433 @@
+# db.py
+"""
+SQLite-хранилище JobWatcher.
+
+- init_db(path): создаёт таблицу seen (и догоняет схему старых БД через ALTER TABLE),
+  а также словарь стемов stems;
+- StemVocab: интернирование стемов в целочисленные id и упаковка
+  последовательности стемов сообщения в компактный BLOB (seen.tokens)
+  со штампом версии токенизатора (seen.tokens_ver).
+  Пересчёт скоринга по истории может брать токены из БД и не трогать NLTK.
+- таблица peers — кэш разрешённых каналов (см. peers.PeerCache);
+- таблица meta — служебные значения (например, время последнего скана демона);
+- unique_key: ключ seen, общий для watcher и scan (иначе плановый скан демона
+  заново присылает уже отправленные watcher'ом посты);
+- TextCodec: прозрачное сжатие seen.raw_text / seen.matches (zlib с общим
+  словарём из таблицы zdicts, обученным на наших вакансиях); старые TEXT-значения
+  читаются как есть;
+- compact_old_rows / incremental_vacuum: ретеншн (у старых строк остаются только
+  отпечаток msg_unique и оценки) и постепенное возвращение страниц ОС.
+"""
+import hashlib
+import re
+import sqlite3
+import struct
+import sys
+import time
+import zlib
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional
+
+from score import DEFAULT_PROFILE, TOKENIZER_VERSION
+
+# колонки seen, добавленные после первой версии схемы: имя -> тип
+_SEEN_EXTRA_COLUMNS = {
+    'raw_text': 'TEXT',
+    'tokens': 'BLOB',
+    'tokens_ver': 'TEXT',
+    'profile': 'TEXT',
+}
+
+# unsigned int (4 байта на всех поддерживаемых платформах), хранится little-endian
+_TOKEN_TYPECODE = 'I'
+_SWAP_BYTES = sys.byteorder == 'big'
+
+
+def init_db(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    if conn.execute("SELECT count(*) FROM sqlite_master").fetchone()[0] == 0:
+        # новая БД: режим incremental_vacuum можно включить без VACUUM
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS seen (
+        msg_unique TEXT PRIMARY KEY,
+        channel TEXT,
+        msg_id INTEGER,
+        status TEXT,
+        score INTEGER,
+        pos_sum INTEGER,
+        neg_sum INTEGER,
+        matches TEXT,
+        raw_text TEXT,
+        first_seen_ts INTEGER
+    )
+    """)
+    cols = {t[1] for t in conn.execute("PRAGMA table_info(seen)")}
+    for name, typ in _SEEN_EXTRA_COLUMNS.items():
+        if name not in cols:
+            conn.execute(f"ALTER TABLE seen ADD COLUMN {name} {typ}")
+    conn.execute("CREATE INDEX IF NOT EXISTS seen_msg_id ON seen(msg_id)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS stems (
+        id INTEGER PRIMARY KEY,
+        stem TEXT UNIQUE NOT NULL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS peers (
+        username TEXT,
+        session TEXT,
+        kind TEXT,
+        peer_id INTEGER,
+        access_hash INTEGER,
+        resolved_ts INTEGER,
+        PRIMARY KEY (username, session)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS zdicts (
+        id INTEGER PRIMARY KEY,
+        dict BLOB NOT NULL,
+        created_ts INTEGER
+    )
+    """)
+    conn.commit()
+    _migrate_seen_keys(conn)
+    return conn
+
+
+def get_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(conn: sqlite3.Connection, key: str, value: str):
+    conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES(?,?)", (key, value))
+    conn.commit()
+
+
+# ---- Ключ seen ----
+
+SEEN_KEY_VERSION = "2"
+
+
+def channel_key(channel) -> str:
+    """Канал без "@" в нижнем регистре — как в ключах seen."""
+    return str(channel or "").strip().lstrip("@").lower()
+
+
+def message_text(conn: sqlite3.Connection, channel, msg_id: int):
+    """
+    raw_text сообщения (как хранится, без распаковки) из любой его строки seen:
+    текст и токены пишутся только в одну из строк сообщения по профилям.
+    """
+    for stored_channel, raw_text in conn.execute(
+        "SELECT channel, raw_text FROM seen WHERE msg_id=? AND raw_text IS NOT NULL", (msg_id,)
+    ):
+        if channel_key(stored_channel) == channel_key(channel):
+            return raw_text
+    return None
+
+
+def unique_key(profile: str, channel: str, text: str) -> str:
+    """
+    Ключ строки seen: "<канал>::<первые 500 символов текста>", канал без "@"
+    в нижнем регистре, текст без крайних пробелов; у профилей кроме default —
+    с префиксом "<профиль>::". Одинаков для watcher и scan.
+    """
+    unique = f"{channel_key(channel)}::{(text or '')[:500].strip()}"
+    if profile == DEFAULT_PROFILE:
+        return unique
+    return f"{profile}::{unique}"
+
+
+def _migrate_seen_keys(conn: sqlite3.Connection):
+    """
+    Один раз переводит ключи старых форматов (scan: "@Канал::текст",
+    watcher: "канал::текст") в формат unique_key. Строки-отпечатки не трогаются:
+    они старше ретеншна, и окна сканов до них не достают.
+    """
+    if get_meta(conn, "seen_key_version") == SEEN_KEY_VERSION:
+        return
+    updates = []
+    rows = conn.execute(
+        "SELECT rowid, msg_unique, channel FROM seen WHERE msg_unique NOT LIKE ?", (FINGERPRINT_PREFIX + "%",)
+    ).fetchall()
+    for rowid, unique, channel in rows:
+        marker = f"{channel}::"
+        pos = unique.find(marker)
+        if channel is None or pos < 0:
+            continue
+        key = unique[:pos] + f"{channel_key(channel)}::{unique[pos + len(marker):].strip()}"
+        if key != unique:
+            updates.append((key, rowid))
+    # один пост, сохранённый и watcher'ом, и scan'ом, сводится к одному ключу:
+    # вторая строка остаётся со старым ключом и больше не используется
+    conn.executemany("UPDATE OR IGNORE seen SET msg_unique=? WHERE rowid=?", updates)
+    set_meta(conn, "seen_key_version", SEEN_KEY_VERSION)
+
+
+def row_profile(profile: Optional[str], unique: str, channel, names) -> Optional[str]:
+    """
+    Профиль строки seen: колонка profile. У строк, записанных до её появления, —
+    по префиксу ключа "<профиль>::<канал>::" (с проверкой канала, чтобы профиль,
+    названный как канал, не забирал строки default); у таких строк после
+    ретеншна (отпечаток) профиль неизвестен — None.
+    """
+    if profile:
+        return profile
+    if unique.startswith(FINGERPRINT_PREFIX):
+        return None
+    channel_prefix = f"{channel_key(channel)}::"
+    for name in names:
+        if name != DEFAULT_PROFILE and unique.startswith(f"{name}::{channel_prefix}"):
+            return name
+    return DEFAULT_PROFILE
+
+
+# ---- Отпечатки: ключ seen у строк после ретеншна ----
+
+FINGERPRINT_PREFIX = "fp:"
+
+
+def fingerprint(unique: str) -> str:
+    """Короткий ключ вместо msg_unique (канал + 500 символов текста) у старых строк."""
+    return FINGERPRINT_PREFIX + hashlib.sha1(unique.encode("utf-8")).hexdigest()
+
+
+def is_seen(conn: sqlite3.Connection, unique: str) -> bool:
+    """Проверка дубля: по полному ключу или по отпечатку (строка прошла ретеншн)."""
+    cur = conn.execute("SELECT 1 FROM seen WHERE msg_unique IN (?, ?)", (unique, fingerprint(unique)))
+    return cur.fetchone() is not None
+
+
+# ---- Сжатие raw_text / matches ----
+
+# формат BLOB: 1 байт версии формата, 2 байта id словаря (0 — без словаря), raw deflate
+_PACK_VERSION = 1
+_PACK_HEADER = struct.Struct("<BH")
+_ZDICT_SIZE = 32 * 1024  # больше deflate всё равно не видит
+_word_re = re.compile(r"\S+")
+
+
+class TextCodec:
+    """
+    pack(text) -> BLOB (или исходная строка, если сжатие не выигрывает / выключено);
+    unpack(value) -> str для любых значений колонки: старые TEXT отдаются как есть.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, enabled: bool = True):
+        self.conn = conn
+        self.enabled = enabled
+        self._dicts: Dict[int, bytes] = {}
+        self.dict_id = 0
+        self.zdict = b""
+        self.reload()
+
+    def reload(self):
+        row = self.conn.execute("SELECT id, dict FROM zdicts ORDER BY id DESC LIMIT 1").fetchone()
+        if row:
+            self.dict_id, self.zdict = row[0], bytes(row[1])
+            self._dicts[self.dict_id] = self.zdict
+
+    def _get_dict(self, dict_id: int) -> bytes:
+        if dict_id == 0:
+            return b""
+        zdict = self._dicts.get(dict_id)
+        if zdict is None:
+            row = self.conn.execute("SELECT dict FROM zdicts WHERE id=?", (dict_id,)).fetchone()
+            zdict = self._dicts[dict_id] = bytes(row[0])
+        return zdict
+
+    def pack(self, text: Optional[str]):
+        if text is None or not self.enabled:
+            return text
+        raw = text.encode("utf-8")
+        if self.zdict:
+            comp = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=self.zdict)
+        else:
+            comp = zlib.compressobj(9, zlib.DEFLATED, -15)
+        blob = _PACK_HEADER.pack(_PACK_VERSION, self.dict_id) + comp.compress(raw) + comp.flush()
+        return blob if len(blob) < len(raw) else text
+
+    def unpack(self, value) -> Optional[str]:
+        if value is None or isinstance(value, str):
+            return value
+        version, dict_id = _PACK_HEADER.unpack_from(value)
+        if version != _PACK_VERSION:
+            raise ValueError(f"unknown packed text version {version}")
+        zdict = self._get_dict(dict_id)
+        decomp = zlib.decompressobj(-15, zdict=zdict) if zdict else zlib.decompressobj(-15)
+        return (decomp.decompress(value[_PACK_HEADER.size:]) + decomp.flush()).decode("utf-8")
+
+
+def train_dict(conn: sqlite3.Connection, codec: TextCodec, sample_rows: int = 2000) -> int:
+    """
+    Обучает общий словарь сжатия на последних sample_rows текстах seen:
+    самые «выгодные» (частота × длина) слова и строки, самые выгодные — в конце
+    словаря (deflate дешевле кодирует близкие ссылки). Возвращает id словаря
+    (0 — если обучать не на чем). Старые словари остаются для чтения старых BLOB.
+    """
+    gain = Counter()
+    rows = conn.execute(
+        "SELECT raw_text FROM seen WHERE raw_text IS NOT NULL ORDER BY rowid DESC LIMIT ?", (sample_rows,)
+    )
+    for (value,) in rows:
+        text = codec.unpack(value)
+        for line in text.splitlines():
+            line = line.strip()
+            if 4 <= len(line) <= 80:
+                gain[line] += len(line)
+        for word in _word_re.findall(text):
+            if len(word) >= 4:
+                gain[word] += len(word)
+    pieces = [p for p, g in gain.most_common() if g > 2 * len(p)]
+    if not pieces:
+        return 0
+    chunks, size = [], 0
+    for piece in pieces:
+        data = piece.encode("utf-8") + b"\n"
+        if size + len(data) > _ZDICT_SIZE:
+            break
+        chunks.append(data)
+        size += len(data)
+    zdict = b"".join(reversed(chunks))
+    dict_id = conn.execute(
+        "INSERT INTO zdicts(dict, created_ts) VALUES(?,?)", (zdict, int(time.time()))
+    ).lastrowid
+    conn.commit()
+    codec.reload()
+    return dict_id
+
+
+RECOMPRESS_KEY = "recompress_last_rowid"
+
+
+def recompress(conn: sqlite3.Connection, codec: TextCodec, batch: int = 500) -> int:
+    """
+    Сжимает ещё не сжатые (TEXT) raw_text/matches пачками по batch; возвращает число строк.
+    Колонки независимы: короткий raw_text может остаться TEXT (сжатие его не уменьшает)
+    при уже сжатом matches — пакуются только TEXT-значения.
+    Просмотренные строки отмечаются в meta (RECOMPRESS_KEY), следующий вызов начинает
+    после отметки: такие несжимаемые значения не перечитываются при каждом обслуживании,
+    а прерванный проход продолжается с места остановки.
+    """
+    def repack(value):
+        return codec.pack(value) if isinstance(value, str) else value
+
+    last_rowid = int(get_meta(conn, RECOMPRESS_KEY) or 0)
+    end = conn.execute("SELECT max(rowid) FROM seen").fetchone()[0] or 0
+    done = 0
+    while last_rowid < end:
+        rows = conn.execute(
+            "SELECT rowid, raw_text, matches FROM seen "
+            "WHERE rowid > ? AND rowid <= ? AND (typeof(raw_text)='text' OR typeof(matches)='text') "
+            "ORDER BY rowid LIMIT ?",
+            (last_rowid, end, batch)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE seen SET raw_text=?, matches=? WHERE rowid=?",
+            [(repack(raw_text), repack(matches), rowid) for rowid, raw_text, matches in rows]
+        )
+        last_rowid = rows[-1][0] if len(rows) == batch else end
+        set_meta(conn, RECOMPRESS_KEY, str(last_rowid))  # коммитит и пачку
+        done += len(rows)
+    return done
+
+
+# ---- Ретеншн и VACUUM ----
+
+def compact_old_rows(conn: sqlite3.Connection, retention_days: float) -> int:
+    """
+    Строки старше retention_days: msg_unique заменяется отпечатком, тексты,
+    совпадения и токены удаляются; статус и оценки остаются, дедуп работает
+    через is_seen.
+    """
+    cutoff = int(time.time() - retention_days * 86400)
+    rows = conn.execute(
+        "SELECT rowid, msg_unique FROM seen WHERE first_seen_ts < ? AND msg_unique NOT LIKE ?",
+        (cutoff, FINGERPRINT_PREFIX + "%")
+    ).fetchall()
+    conn.executemany(
+        "UPDATE OR IGNORE seen SET msg_unique=?, raw_text=NULL, matches=NULL, tokens=NULL, tokens_ver=NULL "
+        "WHERE rowid=?",
+        [(fingerprint(unique), rowid) for rowid, unique in rows]
+    )
+    conn.commit()
+    return len(rows)
+
+
+def incremental_vacuum(conn: sqlite3.Connection, pages: int = 2000) -> Optional[int]:
+    """
+    Возвращает ОС до pages свободных страниц; возвращает число свободных
+    страниц до вызова. Старая БД (создана без auto_vacuum=INCREMENTAL) не
+    трогается и возвращается None: перевести её можно только полным VACUUM,
+    а он может перенумеровать rowid таблицы seen (у неё TEXT PRIMARY KEY),
+    на которых держатся кнопки уведомлений и отметка выгрузки.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return None
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    # прагма освобождает по странице за шаг, а execute() делает один шаг:
+    # executescript выполняет её до конца
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    return free
+
+
+class StemVocab:
+    """
+    Словарь стем <-> id поверх таблицы stems.
+    Новые стемы добавляются в той же транзакции, что и строка seen
+    (commit делает вызывающий код).
+    Таблицу stems могут параллельно пополнять другие процессы (watcher и scan
+    запускаются рядом), поэтому стем, уже добавленный чужим процессом, берётся
+    из БД, а незнакомые id при decode подгружаются.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.ids: Dict[str, int] = {}
+        self.stems: Dict[int, str] = {}
+        self._max_id = 0
+        self.reload()
+
+    def reload(self):
+        """Догружает стемы, добавленные после последней загрузки (в т.ч. другими процессами)."""
+        for sid, stem in self.conn.execute("SELECT id, stem FROM stems WHERE id > ?", (self._max_id,)):
+            self.ids[stem] = sid
+            self.stems[sid] = stem
+            self._max_id = max(self._max_id, sid)
+
+    def intern(self, stem: str) -> int:
+        sid = self.ids.get(stem)
+        if sid is None:
+            self.conn.execute("INSERT OR IGNORE INTO stems(stem) VALUES(?)", (stem,))
+            sid = self.conn.execute("SELECT id FROM stems WHERE stem=?", (stem,)).fetchone()[0]
+            self.ids[stem] = sid
+            self.stems[sid] = stem
+        return sid
+
+    def encode(self, tokens: List[str]) -> bytes:
+        packed = array(_TOKEN_TYPECODE, (self.intern(t) for t in tokens))
+        if _SWAP_BYTES:
+            packed.byteswap()
+        return packed.tobytes()
+
+    def decode(self, blob: Optional[bytes], version: Optional[str]) -> Optional[List[str]]:
+        """Стемы из BLOB; None, если токенов нет или они от другой версии токенизатора."""
+        if blob is None or version != TOKENIZER_VERSION:
+            return None
+        packed = array(_TOKEN_TYPECODE)
+        packed.frombytes(blob)
+        if _SWAP_BYTES:
+            packed.byteswap()
+        if any(sid not in self.stems for sid in packed):
+            self.reload()
+        return [self.stems[sid] for sid in packed]
@@ -0,0 +1,139 @@
+# peers.py
+"""
+Кэш разрешённых каналов (username -> peer id + access_hash) в таблице peers.
+
+Каждое разрешение "@username" стоит запроса ResolveUsername и при частых
+перезапусках упирается в FloodWait. PeerCache хранит результат в БД:
+- записи свежее ttl отдаются без сети;
+- устаревшие перепроверяются запросом ResolveUsername (get_input_entity
+  ответил бы из кэша сущностей сессии Telethon прежним access_hash, не ходя
+  в сеть); если перепроверка упала во FloodWait, используется устаревшая запись;
+- при ошибке доступа к каналу запись инвалидируется (invalidate).
+Каналы, заданные не username'ом (числовой id, инвайт-ссылка t.me/+...),
+разрешаются через client.get_input_entity и кэшируются под str(канала).
+access_hash привязан к аккаунту, поэтому ключ — (username, session).
+"""
+import time
+from typing import Dict, List, Optional
+
+from telethon import functions, utils
+from telethon.errors import FloodWaitError
+from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerUser
+
+DEFAULT_TTL_SEC = 7 * 24 * 3600
+
+
+def _username(channel) -> Optional[str]:
+    """username (в нижнем регистре) из "@name", "name" или ссылки t.me/name; None для id и инвайт-ссылок."""
+    if not isinstance(channel, str):
+        return None
+    username, is_invite = utils.parse_username(channel.strip())
+    return None if is_invite else username
+
+
+def _key(channel) -> str:
+    username = _username(channel)
+    return username or str(channel).strip()
+
+
+def _to_row(peer):
+    """InputPeer -> (kind, peer_id, access_hash) или None, если тип не кэшируем."""
+    if isinstance(peer, InputPeerChannel):
+        return 'channel', peer.channel_id, peer.access_hash
+    if isinstance(peer, InputPeerUser):
+        return 'user', peer.user_id, peer.access_hash
+    if isinstance(peer, InputPeerChat):
+        return 'chat', peer.chat_id, None
+    return None
+
+
+def _from_row(kind: str, peer_id: int, access_hash: Optional[int]):
+    if kind == 'channel':
+        return InputPeerChannel(channel_id=peer_id, access_hash=access_hash)
+    if kind == 'user':
+        return InputPeerUser(user_id=peer_id, access_hash=access_hash)
+    return InputPeerChat(chat_id=peer_id)
+
+
+async def _resolve_username(client, username: str):
+    """InputPeer по username из сети (ResolveUsername), мимо кэша сущностей Telethon."""
+    result = await client(functions.contacts.ResolveUsernameRequest(_username(username)))
+    peer_id = utils.get_peer_id(result.peer)
+    for entity in list(result.chats) + list(result.users):
+        if utils.get_peer_id(entity) == peer_id:
+            return utils.get_input_peer(entity)
+    raise ValueError(f"ResolveUsername {username}: в ответе нет {result.peer}")
+
+
+async def _resolve_channel(client, channel):
+    """InputPeer для канала из конфига: username — через ResolveUsername, id и ссылки — get_input_entity."""
+    if _username(channel):
+        return await _resolve_username(client, channel)
+    if isinstance(channel, str) and channel.strip().lstrip("-").isdigit():
+        channel = int(channel)
+    return await client.get_input_entity(channel)
+
+
+class PeerCache:
+
+    def __init__(self, conn, session: str, ttl_sec: int = DEFAULT_TTL_SEC):
+        self.conn = conn
+        self.session = str(session)
+        self.ttl_sec = ttl_sec
+
+    def _get(self, username: str):
+        """(InputPeer, fresh) или (None, False)."""
+        row = self.conn.execute(
+            "SELECT kind, peer_id, access_hash, resolved_ts FROM peers WHERE username=? AND session=?",
+            (_key(username), self.session)
+        ).fetchone()
+        if not row:
+            return None, False
+        kind, peer_id, access_hash, resolved_ts = row
+        fresh = (time.time() - (resolved_ts or 0)) < self.ttl_sec
+        return _from_row(kind, peer_id, access_hash), fresh
+
+    def cached(self, username: str):
+        """Свежая запись кэша (InputPeer) или None — без обращения к сети."""
+        peer, fresh = self._get(username)
+        return peer if fresh else None
+
+    def put(self, username: str, peer):
+        row = _to_row(peer)
+        if row is None:
+            return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO peers(username, session, kind, peer_id, access_hash, resolved_ts) VALUES(?,?,?,?,?,?)",
+            (_key(username), self.session, *row, int(time.time()))
+        )
+        self.conn.commit()
+
+    def invalidate(self, username: str):
+        self.conn.execute("DELETE FROM peers WHERE username=? AND session=?", (_key(username), self.session))
+        self.conn.commit()
+
+    async def resolve(self, client, username: str):
+        """InputPeer для канала: из свежего кэша, иначе запросом в сеть."""
+        cached, fresh = self._get(username)
+        if cached is not None and fresh:
+            return cached
+        try:
+            peer = await _resolve_channel(client, username)
+        except FloodWaitError:
+            if cached is None:
+                raise
+            print(f"[peers] FloodWait при перепроверке {username}, использую кэш")
+            return cached
+        self.put(username, peer)
+        return peer
+
+    async def resolve_all(self, client, usernames: List[str]) -> Dict[str, object]:
+        """{username: InputPeer}; неразрешимые каналы пропускаются с сообщением в лог."""
+        peers = {}
+        for username in usernames:
+            try:
+                peers[username] = await self.resolve(client, username)
+            except Exception as e:
+                self.invalidate(username)
+                print(f"[peers] Не удалось разрешить {username}: {e}")
+        return peers
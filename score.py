@@ -20,16 +20,28 @@
       'matches': { 'excellent': [...], 'acceptable': [...], 'negative': [...], 'strong_negative': [...], 'ignore': [...] },
       'summary': str
     }
+- каскад: ignore_markers сначала ищутся дешёвым префильтром по сырому тексту
+  (один регэксп на префиксы стемов, стеммятся только найденные слова);
+  полный стемминг текста выполняется только для прошедших префильтр сообщений;
+- несколько профилей маркеров (cfg['profiles']) считаются за один проход
+  токенизации/поиска: score_profiles(text, get_profiles(cfg)).
+- cfg['context_keywords'] (множители предложений старого скоринга watcher)
+  не поддерживается: маркер учитывается один раз на сообщение с весом категории.
 """
 import re
 import os
-from typing import Dict, List, Tuple
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 
+import nltk
 from nltk.stem.snowball import SnowballStemmer
 from nltk.stem import PorterStemmer
 
 # debug: установите SCORE_DEBUG=1 в окружении, чтобы видеть лог
 DEBUG = bool(os.getenv("SCORE_DEBUG"))
+# проверка каскада: SCORE_CASCADE_CHECK=1 — каждое раннее отсечение префильтром
+# перепроверяется полным движком; расхождение логируется, берётся результат полного движка
+CASCADE_CHECK = bool(os.getenv("SCORE_CASCADE_CHECK"))
 
 # Стеммеры
 ru_stemmer = SnowballStemmer("russian")
@@ -70,15 +82,33 @@ def normalize_word(word: str) -> str:
 
 _token_re = re.compile(r"[а-яА-ЯёЁa-zA-Z0-9#\+]+", flags=re.UNICODE)
 
+# Версия токенизации/стемминга. Увеличить при любом изменении _token_re,
+# _clean_token или normalize_word: сохранённые в БД токены старой версии
+# перестанут использоваться. Версия NLTK тоже входит в штамп.
+_TOKENIZER_REV = 1
+TOKENIZER_VERSION = f"{_TOKENIZER_REV}:nltk-{nltk.__version__}"
+
 
 def normalize_phrase(phrase: str) -> str:
     """
     Стеммируем фразу — каждое слово отдельно и возвращаем через пробел.
     Если фраза содержит несколько слов (например "api testing"), сохранится порядок.
     """
-    tokens = _token_re.findall(phrase or "")
-    stems = [normalize_word(t) for t in tokens if normalize_word(t)]
-    return " ".join(stems)
+    return " ".join(_norm_tokens(phrase))
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Нормализованная последовательность стемов сообщения — то, по чему идёт скоринг.
+    Её можно сохранить и позже передать в score_and_classify/score_profiles (tokens=...).
+    """
+    return _norm_tokens((text or "").lower())
+
+
+def _norm_tokens(text: str) -> List[str]:
+    """Токенизация + стемминг: список непустых стемов в порядке следования."""
+    stems = (normalize_word(t) for t in _token_re.findall(text or ""))
+    return [s for s in stems if s]
 
 
 def _build_norm_map(markers: List[str]) -> List[Tuple[str, str]]:
@@ -89,6 +119,12 @@ def _build_norm_map(markers: List[str]) -> List[Tuple[str, str]]:
     """
     if not markers:
         return []
+    return _build_norm_map_cached(tuple(markers))
+
+
+@lru_cache(maxsize=None)
+def _build_norm_map_cached(markers: Tuple[str, ...]) -> List[Tuple[str, str]]:
+    """Кэш норм-мапов: маркеры одинаковы для всех сообщений, стеммим их один раз."""
     # norm -> orig (first seen)
     seen = {}
     # сортируем по длине (desc) чтобы фразы шли раньше коротких
@@ -112,20 +148,224 @@ def _regex_contains(norm_phrase: str, text_norm: str) -> bool:
     return re.search(pat, text_norm) is not None
 
 
-def score_and_classify(text: str, cfg: Dict) -> Dict:
+def _contains(norm_phrase: str, text_norm: str, hits: Dict[str, bool]) -> bool:
+    """
+    _regex_contains с мемоизацией в hits: один и тот же маркер из разных
+    профилей ищется в тексте только один раз.
+    """
+    hit = hits.get(norm_phrase)
+    if hit is None:
+        hit = hits[norm_phrase] = _regex_contains(norm_phrase, text_norm)
+    return hit
+
+
+DEFAULT_PROFILE = "default"
+
+
+def get_profiles(cfg: Dict) -> List[Dict]:
+    """
+    Профили маркеров/порогов.
+
+    Верхнеуровневые markers/thresholds образуют профиль "default"
+    (target_chat_id = None — вызывающий код шлёт в свой чат по умолчанию).
+    Дополнительные профили задаются в cfg['profiles'] как
+    name -> {target_chat_id, markers, thresholds}; отсутствующие ключи
+    наследуются от верхнего уровня.
+    Каждый профиль — dict того же вида, что cfg, и годится для score_and_classify.
+    """
+    if not isinstance(cfg, dict):
+        cfg = {}
+    extra = cfg.get("profiles") or {}
+    profiles = []
+    if cfg.get("markers") or not extra:
+        profiles.append({
+            'name': DEFAULT_PROFILE,
+            'target_chat_id': None,
+            'markers': cfg.get("markers") or {},
+            'thresholds': cfg.get("thresholds") or {},
+        })
+    for name, prof in extra.items():
+        prof = prof or {}
+        profiles.append({
+            'name': str(name),
+            'target_chat_id': prof.get("target_chat_id"),
+            'markers': prof.get("markers") or cfg.get("markers") or {},
+            'thresholds': prof.get("thresholds") or cfg.get("thresholds") or {},
+        })
+    return profiles
+
+
+# ---- Каскад: префильтр ignore_markers по сырому тексту ----
+
+_TOKEN_CHARS = r"а-яА-ЯёЁa-zA-Z0-9#\+"
+# между словами фразы: токены только из #/+ стемминг выбрасывает целиком
+_PHRASE_SEP = r"[^а-яА-ЯёЁa-zA-Z0-9]+"
+
+
+def _stem_prefix_pattern(stem: str) -> str:
+    """
+    Регэксп для токена, чей стем может совпасть со stem.
+    Русский Snowball только отрезает окончания (и ё -> е), Porter может
+    поменять последнюю букву (gaming -> game, happy -> happi), поэтому
+    ищем по стему без последней буквы и добираем токен до конца.
+    """
+    prefix = stem[:-1] if len(stem) > 2 else stem
+    body = "".join("[её]" if ch == "е" else re.escape(ch) for ch in prefix)
+    return r"[#\+]*" + body + f"[{_TOKEN_CHARS}]*"
+
+
+@lru_cache(maxsize=None)
+def _ignore_prefilter(markers: Tuple[str, ...]):
+    """
+    (any_re, [(norm, orig, pattern), ...]) для набора ignore_markers.
+    any_re — один регэксп нулевой ширины, находящий начала токенов,
+    с которых может начинаться любой из маркеров.
+    """
+    pats = []
+    for norm, orig in _build_norm_map(list(markers)):
+        body = _PHRASE_SEP.join(_stem_prefix_pattern(st) for st in norm.split())
+        pats.append((norm, orig, body))
+    if not pats:
+        return None, []
+    any_re = re.compile(
+        f"(?<![{_TOKEN_CHARS}])(?=" + "|".join(body for _, _, body in pats) + ")",
+        flags=re.IGNORECASE
+    )
+    return any_re, [(norm, orig, re.compile(body, flags=re.IGNORECASE)) for norm, orig, body in pats]
+
+
+def _prefilter_ignore(text: str, cfg: Dict) -> Optional[str]:
+    """
+    Первая ступень каскада. Возвращает исходный ignore-маркер, который
+    полный движок нашёл бы первым, или None — тогда нужен полный скоринг.
+    Кандидаты из регэкспа подтверждаются стеммингом только найденных слов,
+    поэтому ложных отсечений нет; пропуск маркера префильтром лишь
+    передаёт сообщение полному движку.
+    """
+    markers = ((cfg.get("markers") or {}) if isinstance(cfg, dict) else {}).get("ignore_markers") or []
+    if not markers or not text:
+        return None
+    any_re, pats = _ignore_prefilter(tuple(markers))
+    if any_re is None:
+        return None
+    found = set()
+    for m in any_re.finditer(text):
+        pos = m.start()
+        for norm, orig, pat in pats:
+            if norm in found:
+                continue
+            hit = pat.match(text, pos)
+            if hit and " ".join(_norm_tokens(hit.group(0).lower())) == norm:
+                found.add(norm)
+    for norm, orig, _ in pats:
+        if norm in found:
+            return orig
+    return None
+
+
+def _ignore_result(orig: str) -> Dict:
+    return {
+        'final_score': None,
+        'positive_sum': 0,
+        'negative_sum': 0,
+        'matches': {'excellent': [], 'acceptable': [], 'negative': [], 'strong_negative': [], 'ignore': [orig]},
+        'summary': f"Точно нет (ignore: {orig})"
+    }
+
+
+def cascade_mismatch(text: str, cfg: Dict) -> Optional[Tuple[Dict, Dict]]:
+    """
+    Проверка каскада на одном тексте: (результат каскада, результат полного движка),
+    если префильтр отсёк сообщение и результаты разошлись; иначе None.
+    """
+    orig = _prefilter_ignore(text, cfg)
+    if orig is None:
+        # префильтр ничего не решил — результат и так считает полный движок
+        return None
+    fast = _ignore_result(orig)
+    full = _score_norm(" ".join(tokenize(text)), cfg)
+    return None if fast == full else (fast, full)
+
+
+def _prefiltered(text: str, cfg: Dict) -> Optional[Dict]:
+    """Результат первой ступени каскада (ignore) или None."""
+    orig = _prefilter_ignore(text, cfg)
+    if orig is None:
+        return None
+    if DEBUG:
+        print(f"[score] IGNORE prefiltered: {orig}")
+    if CASCADE_CHECK:
+        full = _score_norm(" ".join(tokenize(text)), cfg)
+        if full != _ignore_result(orig):
+            print(f"[score] CASCADE MISMATCH: prefilter ignore={orig!r}, full engine={full!r}")
+            return full
+    return _ignore_result(orig)
+
+
+def score_and_tokenize(text: str, profiles: List[Dict]) -> Tuple[Dict[str, Dict], Optional[List[str]]]:
+    """
+    Как score_profiles, но возвращает ещё и токены tokenize(text) — или None,
+    если все профили отсекли сообщение префильтром и текст не стеммился.
+    """
+    results = {}
+    survivors = []
+    for p in profiles:
+        res = _prefiltered(text, p)
+        if res is None:
+            survivors.append(p)
+        else:
+            results[p['name']] = res
+    tokens = None
+    if survivors:
+        tokens = tokenize(text)
+        results.update(score_profiles(text, survivors, tokens=tokens))
+    return {p['name']: results[p['name']] for p in profiles}, tokens
+
+
+def score_profiles(text: str, profiles: List[Dict], tokens: Optional[List[str]] = None) -> Dict[str, Dict]:
+    """
+    Скоринг сообщения сразу для нескольких профилей.
+    Токенизация/стемминг текста и поиск каждого уникального маркера
+    выполняются один раз на сообщение, независимо от числа профилей.
+    tokens — готовый результат tokenize(text); если передан, text не стеммится
+    (и префильтр не нужен). Без tokens сначала работает префильтр ignore.
+    Возвращает {profile_name: результат score_and_classify}.
+    """
+    if tokens is None:
+        return score_and_tokenize(text, profiles)[0]
+    text_norm = " ".join(tokens)
+    if DEBUG:
+        print("[score] text_norm:", text_norm)
+    hits: Dict[str, bool] = {}
+    return {p['name']: _score_norm(text_norm, p, hits) for p in profiles}
+
+
+def score_and_classify(text: str, cfg: Dict, tokens: Optional[List[str]] = None) -> Dict:
     """
     Основная функция скоринга.
+    tokens — готовый результат tokenize(text) (например, из БД); тогда text не стеммится.
+    Без tokens сначала работает префильтр ignore (каскад).
     """
-    text = text or ""
     # нормализованный и стеммированный текст (строка)
     # Используем ту же tokenization что и для маркеров
-    text_tokens = _token_re.findall(text.lower())
-    text_norm_tokens = [normalize_word(t) for t in text_tokens if normalize_word(t)]
-    text_norm = " ".join(text_norm_tokens)
+    if tokens is None:
+        res = _prefiltered(text, cfg)
+        if res is not None:
+            return res
+        tokens = tokenize(text)
+    text_norm = " ".join(tokens)
 
     if DEBUG:
         print("[score] text_norm:", text_norm)
 
+    return _score_norm(text_norm, cfg, {})
+
+
+def _score_norm(text_norm: str, cfg: Dict, hits: Optional[Dict[str, bool]] = None) -> Dict:
+    """Скоринг уже нормализованного текста по маркерам/порогам из cfg."""
+    if hits is None:
+        hits = {}
+
     # взять маркеры из cfg['markers']
     markers_block = {}
     if isinstance(cfg, dict):
@@ -151,22 +391,15 @@ def score_and_classify(text: str, cfg: Dict) -> Dict:
 
     # 1) Проверка на игнор (если найден — завершить обработку и вернуть final_score = None)
     for norm, orig in ign_map:
-        if _regex_contains(norm, text_norm):
-            matches['ignore'].append(orig)
+        if _contains(norm, text_norm, hits):
             if DEBUG:
                 print(f"[score] IGNORE matched: {orig} (norm='{norm}'). Returning ignore.")
-            return {
-                'final_score': None,
-                'positive_sum': int(positive_sum),
-                'negative_sum': int(abs(negative_sum)),
-                'matches': matches,
-                'summary': f"Точно нет (ignore: {orig})"
-            }
+            return _ignore_result(orig)
 
     # 2) Собираем все совпадения и суммируем
     # strong negative
     for norm, orig in sneg_map:
-        if _regex_contains(norm, text_norm):
+        if _contains(norm, text_norm, hits):
             matches['strong_negative'].append(orig)
             negative_sum += abs(WEIGHT_STRONG_NEG)  # accumulate as positive magnitude for negative_sum
             if DEBUG:
@@ -174,7 +407,7 @@ def score_and_classify(text: str, cfg: Dict) -> Dict:
 
     # acceptable (+1)
     for norm, orig in acc_map:
-        if _regex_contains(norm, text_norm):
+        if _contains(norm, text_norm, hits):
             matches['acceptable'].append(orig)
             positive_sum += WEIGHT_ACCEPTABLE
             if DEBUG:
@@ -182,7 +415,7 @@ def score_and_classify(text: str, cfg: Dict) -> Dict:
 
     # excellent (+2)
     for norm, orig in exc_map:
-        if _regex_contains(norm, text_norm):
+        if _contains(norm, text_norm, hits):
             matches['excellent'].append(orig)
             positive_sum += WEIGHT_EXCELLENT
             if DEBUG:
@@ -190,7 +423,7 @@ def score_and_classify(text: str, cfg: Dict) -> Dict:
 
     # negative (-1)
     for norm, orig in neg_map:
-        if _regex_contains(norm, text_norm):
+        if _contains(norm, text_norm, hits):
             matches['negative'].append(orig)
             negative_sum += abs(WEIGHT_NEGATIVE)
             if DEBUG:
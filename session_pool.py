@@ -0,0 +1,188 @@
+# session_pool.py
+"""
+Пул Telegram-сессий для сканирования истории.
+
+- каналы распределяются по сессиям консистентным хешированием (кольцо с
+  виртуальными узлами): добавление/удаление аккаунта переносит только
+  малую часть каналов, а кэш peers каждой сессии остаётся тёплым;
+- у каждой сессии свой ограничитель частоты запросов (RateLimiter);
+- FloodWait блокирует сессию на указанное время, канал продолжает читаться
+  следующей по кольцу сессией с того же offset_id;
+- SessionPool.stream() читает все каналы параллельно и отдаёт (канал, сообщение)
+  одним потоком через ограниченную очередь — его потребитель (scan_history)
+  единственный, кто пишет в БД.
+"""
+import asyncio
+import bisect
+import hashlib
+import time
+from typing import Dict, List, Optional
+
+from telethon.errors import FloodWaitError, RPCError
+
+PAGE_SIZE = 100  # максимум сообщений в одном GetHistory
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class RateLimiter:
+    """Не чаще per_sec запросов в секунду (равномерно); per_sec <= 0 — без ограничения."""
+
+    def __init__(self, per_sec: float):
+        self.interval = 1.0 / per_sec if per_sec > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+                now = self._next
+            self._next = now + self.interval
+
+
+class PoolSession:
+
+    def __init__(self, name: str, client, peer_cache, requests_per_sec: float = 1.0, phone: Optional[str] = None):
+        self.name = name
+        self.client = client
+        self.peer_cache = peer_cache
+        self.limiter = RateLimiter(requests_per_sec)
+        self.phone = phone
+        self.blocked_until = 0.0
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def resolve(self, channel: str):
+        cached = self.peer_cache.cached(channel)
+        if cached is not None:
+            return cached
+        await self.limiter.acquire()
+        return await self.peer_cache.resolve(self.client, channel)
+
+
+class SessionPool:
+
+    VNODES = 64
+
+    def __init__(self, sessions: List[PoolSession]):
+        if not sessions:
+            raise ValueError("SessionPool needs at least one session")
+        self.sessions = sessions
+        self._ring = sorted(
+            (_hash(f"{s.name}#{i}"), idx) for idx, s in enumerate(sessions) for i in range(self.VNODES)
+        )
+        self._ring_keys = [h for h, _ in self._ring]
+        self.failed: Dict[str, str] = {}  # канал -> ошибка за последний stream()
+
+    async def start(self):
+        """Запускает клиентов пула, кроме первого (основной клиент запускает вызывающий код)."""
+        for s in self.sessions[1:]:
+            await s.client.start(phone=s.phone)
+
+    async def disconnect(self):
+        for s in self.sessions[1:]:
+            await s.client.disconnect()
+
+    def candidates(self, channel: str) -> List[PoolSession]:
+        """Сессии в порядке обхода кольца от канала: первая — основная для канала."""
+        start = bisect.bisect(self._ring_keys, _hash(str(channel).lstrip("@").lower()))
+        order = []
+        for i in range(len(self._ring)):
+            idx = self._ring[(start + i) % len(self._ring)][1]
+            if idx not in order:
+                order.append(idx)
+                if len(order) == len(self.sessions):
+                    break
+        return [self.sessions[idx] for idx in order]
+
+    async def _pick(self, channel: str) -> PoolSession:
+        """Первая по кольцу незаблокированная сессия; если все во FloodWait — ждём ближайшую."""
+        candidates = self.candidates(channel)
+        now = time.monotonic()
+        for s in candidates:
+            if s.blocked_until <= now:
+                return s
+        soonest = min(candidates, key=lambda s: s.blocked_until)
+        await asyncio.sleep(soonest.blocked_until - now)
+        return soonest
+
+    async def iter_channel(self, channel: str, since, limit: int):
+        """
+        Сообщения канала от новых к старым, пока дата >= since (naive UTC) и не больше limit.
+        Закэшированный peer, отвергнутый Telegram, инвалидируется и разрешается заново
+        (один раз на сессию).
+        """
+        offset_id = 0
+        fetched = 0
+        reresolved = set()
+        while fetched < limit:
+            sess = await self._pick(channel)
+            want = min(PAGE_SIZE, limit - fetched)
+            try:
+                entity = await sess.resolve(channel)
+                await sess.limiter.acquire()
+                batch = await sess.client.get_messages(entity, limit=want, offset_id=offset_id)
+            except FloodWaitError as e:
+                sess.block(e.seconds)
+                print(f"[pool] {sess.name}: FloodWait {e.seconds}s на {channel}, переключаюсь")
+                continue
+            except (ValueError, RPCError) as e:
+                sess.peer_cache.invalidate(channel)
+                if sess.name in reresolved:
+                    raise
+                reresolved.add(sess.name)
+                print(f"[pool] {sess.name}: {channel}: {e}; разрешаю канал заново")
+                continue
+
+            for msg in batch:
+                if not msg:
+                    continue
+                fetched += 1
+                offset_id = msg.id
+                msg_date = getattr(msg, 'date', None)
+                if msg_date is not None and msg_date.replace(tzinfo=None) < since:
+                    return
+                yield msg
+            if len(batch) < want:
+                return
+
+    async def stream(self, channels: List[str], since, limit: int, queue_size: int = 500):
+        """
+        Все каналы параллельно, на выходе единый поток (канал, сообщение).
+        since — naive UTC datetime для всех каналов или {канал: datetime}.
+        """
+        queue = asyncio.Queue(maxsize=queue_size)
+        done = object()
+        self.failed = {}
+
+        async def worker(channel):
+            count = 0
+            try:
+                channel_since = since[channel] if isinstance(since, dict) else since
+                async for msg in self.iter_channel(channel, channel_since, limit):
+                    count += 1
+                    await queue.put((channel, msg))
+            except Exception as e:
+                self.failed[channel] = str(e)
+                print(f"[pool] {channel}: ошибка сканирования: {e}")
+            finally:
+                print(f"[pool] {channel}: получено {count} сообщений")
+                await queue.put((channel, done))
+
+        tasks = [asyncio.create_task(worker(ch)) for ch in channels]
+        remaining = len(tasks)
+        try:
+            while remaining:
+                channel, msg = await queue.get()
+                if msg is done:
+                    remaining -= 1
+                    continue
+                yield channel, msg
+        finally:
+            for task in tasks:
+                task.cancel()
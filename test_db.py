@@ -0,0 +1,157 @@
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+from db import (init_db, is_seen, set_meta, unique_key, fingerprint, row_profile, StemVocab, TextCodec,
+                train_dict, recompress, compact_old_rows, incremental_vacuum)
+from score import tokenize, TOKENIZER_VERSION
+
+tmp_dir = tempfile.mkdtemp(prefix="jobwatcher-test-")
+db_path = os.path.join(tmp_dir, "test.db")
+
+# ==== 1. Словарь стемов: два процесса пополняют stems одновременно ====
+conn_a = init_db(db_path)
+conn_b = init_db(db_path)
+vocab_a = StemVocab(conn_a)
+vocab_b = StemVocab(conn_b)
+
+tokens = tokenize("QA Automation Engineer, удалённо, Python")
+blob_a = vocab_a.encode(tokens)
+conn_a.commit()
+
+# b ещё не знает стемов a: вставка тех же стемов не падает и даёт те же id
+blob_b = vocab_b.encode(tokens)
+conn_b.commit()
+assert blob_a == blob_b, "vocab ids differ between processes"
+
+# b декодирует токены, записанные a со стемами, которых b ещё не видел
+more = tokenize("Senior Java разработчик в офис")
+blob_more = vocab_a.encode(more)
+conn_a.commit()
+assert vocab_b.decode(blob_more, TOKENIZER_VERSION) == more, "decode of foreign stems failed"
+assert vocab_b.decode(blob_a, "0:old") is None
+conn_a.close()
+conn_b.close()
+print("vocab OK")
+
+
+# ==== 2. Ключи seen старых форматов переводятся в unique_key ====
+conn = init_db(os.path.join(tmp_dir, "keys.db"))
+text = " QA Engineer, удалённо "
+conn.executemany(
+    "INSERT INTO seen(msg_unique, channel, msg_id, status) VALUES(?,?,?,?)",
+    [("@ForAllQA::" + text, "@ForAllQA", 1, "scan"),            # скан: канал из конфига, текст как есть
+     ("aqa::qa_work::" + text.strip(), "qa_work", 2, "watcher"),  # watcher: username без "@"
+     ("forallqa::" + text.strip(), "forallqa", 1, "dup")]         # тот же пост от watcher
+)
+set_meta(conn, "seen_key_version", "1")
+conn.close()
+conn = init_db(os.path.join(tmp_dir, "keys.db"))
+assert is_seen(conn, unique_key("default", "@forallqa", text))
+assert is_seen(conn, unique_key("aqa", "@qa_work", text))
+# дубль (пост есть от обоих путей) не ломает миграцию: ключ остаётся за одной строкой
+assert conn.execute("SELECT count(*) FROM seen").fetchone()[0] == 3
+conn.close()
+print("seen keys OK")
+
+# ==== 2a. Профиль строки: колонка profile, у старых строк — префикс ключа с проверкой канала ====
+names = ["default", "qa_work"]  # профиль назван как канал @qa_work
+default_key = unique_key("default", "@qa_work", text)
+profile_key = unique_key("qa_work", "@qa_work", text)
+assert row_profile(None, default_key, "@qa_work", names) == "default"
+assert row_profile(None, profile_key, "@qa_work", names) == "qa_work"
+assert row_profile("qa_work", fingerprint(profile_key), "@qa_work", names) == "qa_work"
+assert row_profile(None, fingerprint(profile_key), "@qa_work", names) is None
+print("row profile OK")
+
+
+# ==== 3. Сжатие: pack/unpack, смешанные TEXT/BLOB строки, recompress ====
+conn = init_db(os.path.join(tmp_dir, "codec.db"))
+codec = TextCodec(conn)
+post = "Ищем QA engineer (middle), удалённо. Ручное тестирование API, Postman, SQL. Зарплата по итогам собеседования.\n"
+assert codec.pack("ok") == "ok", "incompressible text must stay TEXT"
+assert codec.pack(None) is None and codec.unpack(None) is None
+assert isinstance(codec.pack(post * 3), bytes) and codec.unpack(codec.pack(post * 3)) == post * 3
+assert TextCodec(conn, enabled=False).pack(post) == post
+
+matches = json.dumps({'excellent': ['qa engineer', 'postman', 'sql', 'api'], 'acceptable': [], 'negative': [],
+                      'strong_negative': [], 'ignore': []}, ensure_ascii=False)
+rows = {}
+for i in range(60):
+    raw_text = "ok" if i % 10 == 0 else f"{post}#{i}\n{post}"
+    rows[i] = (raw_text, matches)
+    conn.execute(
+        "INSERT INTO seen(msg_unique, channel, msg_id, status, matches, raw_text, first_seen_ts) VALUES(?,?,?,?,?,?,?)",
+        (unique_key("default", "@ch", raw_text + str(i)), "@ch", i, "new", matches, raw_text, int(time.time()))
+    )
+conn.commit()
+# первый проход: matches сжимается, короткий raw_text остаётся TEXT; второй проход
+# видит такую смешанную строку и не должен падать
+assert recompress(conn, codec, batch=25) == 60
+assert conn.execute("SELECT typeof(raw_text), typeof(matches) FROM seen WHERE msg_id=0").fetchone() == ('text', 'blob')
+# просмотренные строки с отметки не перечитываются, в том числе оставшиеся TEXT
+assert recompress(conn, codec) == 0
+# после обучения словаря новые значения сжимаются с ним, старые читаются прежним
+assert train_dict(conn, codec) > 0
+assert codec.unpack(codec.pack(post * 2)) == post * 2
+rows[60] = (f"{post}#60\n{post}", matches)
+conn.execute("INSERT INTO seen(msg_unique, channel, msg_id, status, matches, raw_text) VALUES(?,?,?,?,?,?)",
+             ("new", "@ch", 60, "new", matches, rows[60][0]))
+conn.commit()
+assert recompress(conn, codec) == 1
+assert conn.execute("SELECT typeof(raw_text) FROM seen WHERE msg_id=60").fetchone() == ('blob',)
+for msg_id, raw_text, value in conn.execute("SELECT msg_id, raw_text, matches FROM seen"):
+    assert (codec.unpack(raw_text), codec.unpack(value)) == rows[msg_id], msg_id
+print("codec OK")
+
+# ==== 4. Ретеншн: ключ -> отпечаток, is_seen по полному ключу, rowid прежний ====
+old_key = unique_key("default", "@ch", rows[5][0] + "5")
+old_rowid = conn.execute("SELECT rowid FROM seen WHERE msg_unique=?", (old_key,)).fetchone()[0]
+conn.execute("UPDATE seen SET first_seen_ts=? WHERE msg_id < 30", (int(time.time()) - 200 * 86400,))
+conn.commit()
+assert compact_old_rows(conn, 90) == 30
+assert compact_old_rows(conn, 90) == 0
+row = conn.execute("SELECT rowid, raw_text, matches, status FROM seen WHERE msg_unique=?", (fingerprint(old_key),)).fetchone()
+assert row == (old_rowid, None, None, "new")
+assert is_seen(conn, old_key)
+assert not is_seen(conn, unique_key("default", "@ch", "новый пост"))
+conn.close()
+print("retention OK")
+
+# ==== 5. incremental_vacuum: старая БД не переводится (VACUUM), новая отдаёт страницы ====
+vac_path = os.path.join(tmp_dir, "vacuum.db")
+legacy = sqlite3.connect(vac_path)
+legacy.execute("CREATE TABLE seen (msg_unique TEXT PRIMARY KEY, channel TEXT, msg_id INTEGER, status TEXT, "
+               "score INTEGER, pos_sum INTEGER, neg_sum INTEGER, matches TEXT, raw_text TEXT, first_seen_ts INTEGER)")
+legacy.commit()
+legacy.close()
+conn = init_db(vac_path)
+conn.executemany("INSERT INTO seen(msg_unique, raw_text) VALUES(?,?)", [(f"k{i}", post * 20) for i in range(500)])
+conn.execute("DELETE FROM seen WHERE rowid % 7 != 0")
+conn.commit()
+keep = conn.execute("SELECT rowid, msg_unique FROM seen").fetchall()
+pages = conn.execute("PRAGMA page_count").fetchone()[0]
+assert incremental_vacuum(conn, 10 ** 6) is None
+assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+assert conn.execute("PRAGMA page_count").fetchone()[0] == pages
+assert conn.execute("SELECT rowid, msg_unique FROM seen").fetchall() == keep
+conn.close()
+
+conn = init_db(os.path.join(tmp_dir, "vacuum_new.db"))
+assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+conn.executemany("INSERT INTO seen(msg_unique, raw_text) VALUES(?,?)", [(f"k{i}", post * 20) for i in range(500)])
+conn.execute("DELETE FROM seen WHERE rowid % 7 != 0")
+conn.commit()
+keep = conn.execute("SELECT rowid, msg_unique FROM seen").fetchall()
+pages = conn.execute("PRAGMA page_count").fetchone()[0]
+free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+assert incremental_vacuum(conn, 10) == free
+assert conn.execute("PRAGMA freelist_count").fetchone()[0] == free - 10
+incremental_vacuum(conn, 10 ** 6)
+assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+assert conn.execute("PRAGMA page_count").fetchone()[0] < pages
+assert conn.execute("SELECT rowid, msg_unique FROM seen").fetchall() == keep
+conn.close()
+print("vacuum OK")
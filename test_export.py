@@ -0,0 +1,69 @@
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+
+import yaml
+
+if importlib.util.find_spec("pyarrow") is None:
+    print("pyarrow не установлен — проверка выгрузки пропущена")
+    sys.exit(0)
+
+import pyarrow.dataset as ds
+
+from db import init_db, unique_key, TextCodec
+from tg_job_export import export
+
+with open("config.yaml", "r", encoding="utf-8") as f:
+    cfg = yaml.safe_load(f)
+
+tmp_dir = tempfile.mkdtemp(prefix="jobwatcher-test-")
+conn = init_db(os.path.join(tmp_dir, "test.db"))
+codec = TextCodec(conn)
+cfg = dict(cfg, profiles=None, export={'dir': os.path.join(tmp_dir, "export"), 'format': 'parquet', 'batch_rows': 2})
+
+day = 86400
+now = int(time.time()) // day * day + 3600
+
+
+def insert(channel, msg_id, matches, ts, pack=True):
+    text = f"пост {msg_id}"
+    value = json.dumps(matches, ensure_ascii=False)
+    conn.execute(
+        "INSERT INTO seen(msg_unique, channel, msg_id, status, score, pos_sum, neg_sum, matches, raw_text, first_seen_ts) "
+        "VALUES(?,?,?,?,?,?,?,?,?,?)",
+        (unique_key("default", channel, text), channel, msg_id, "Хорошее совпадение", 3, 4, 1,
+         codec.pack(value) if pack else value, codec.pack(text), ts)
+    )
+    conn.commit()
+
+
+# ==== 1. Строки нового формата и старого watcher ([маркер, предложение]) ====
+insert("@ForAllQA", 1, {'excellent': ['qa', 'api'], 'acceptable': [], 'negative': ['java'],
+                        'strong_negative': [], 'ignore': []}, now)
+insert("qa_work", 2, {'excellent': [['qa', 'Ищем QA'], ['api', 'тестирование API']],
+                      'negative': [['java', 'знание Java']]}, now - day, pack=False)
+insert("qa_work", 3, {'ignore': ['реклама']}, now)
+stats = export(conn, cfg)
+assert stats['rows'] == 3 and stats['batches'] == 2, stats
+
+table = ds.dataset(cfg['export']['dir'], format="parquet", partitioning="hive").to_table()
+rows = {row['msg_id']: row for row in table.to_pylist()}
+assert rows[1]['excellent'] == rows[2]['excellent'] == ['qa', 'api']
+assert rows[2]['negative'] == ['java'] and rows[2]['n_negative'] == 1
+assert rows[2]['acceptable'] == [] and rows[3]['ignore'] == ['реклама']
+assert rows[1]['channel'] == 'forallqa' and rows[2]['channel'] == 'qa_work'
+assert rows[1]['date'] != rows[2]['date']
+assert rows[1]['profile'] == 'default'
+print("export legacy matches OK")
+
+# ==== 2. Инкрементальная дозапись: только новые строки ====
+assert export(conn, cfg)['rows'] == 0
+insert("@ForAllQA", 4, {'excellent': ['qa']}, now)
+assert export(conn, cfg) == {'rows': 1, 'batches': 1, 'last_rowid': 4}
+table = ds.dataset(cfg['export']['dir'], format="parquet", partitioning="hive").to_table()
+assert sorted(table.column('msg_id').to_pylist()) == [1, 2, 3, 4]
+conn.close()
+print("export incremental OK")
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import tempfile
+
+from telethon.errors import FloodWaitError
+from telethon import utils
+from telethon.tl.types import Channel, ChatPhotoEmpty, InputPeerChannel, PeerChannel
+from telethon.tl.types.contacts import ResolvedPeer
+
+from db import init_db
+from peers import PeerCache
+
+tmp_dir = tempfile.mkdtemp(prefix="jobwatcher-test-")
+conn = init_db(os.path.join(tmp_dir, "test.db"))
+
+
+class FakeClient:
+    """Отвечает на ResolveUsername каналом с текущим access_hash; кэша сущностей нет."""
+
+    def __init__(self, channel_id: int, access_hash: int):
+        self.channel_id = channel_id
+        self.access_hash = access_hash
+        self.requests = []
+        self.entities = []
+        self.flood = False
+
+    async def __call__(self, request):
+        self.requests.append(request.username)
+        if self.flood:
+            raise FloodWaitError(request=request, capture=30)
+        channel = Channel(id=self.channel_id, title="QA", photo=ChatPhotoEmpty(), date=None,
+                          access_hash=self.access_hash, username=request.username)
+        return ResolvedPeer(peer=PeerChannel(self.channel_id), chats=[channel], users=[])
+
+    async def get_input_entity(self, peer):
+        # username'ы сюда попадать не должны: get_input_entity отвечает из кэша сессии, не из сети
+        assert not isinstance(peer, str) or utils.parse_username(peer)[1], peer
+        self.entities.append(peer)
+        return InputPeerChannel(7, 777)
+
+
+def expire(username: str):
+    conn.execute("UPDATE peers SET resolved_ts=0 WHERE username=?", (username,))
+    conn.commit()
+
+
+async def check_resolve():
+    client = FakeClient(42, access_hash=111)
+    cache = PeerCache(conn, "main", ttl_sec=3600)
+
+    # ==== 1. Промах кэша: запрос в сеть, запись в peers ====
+    assert await cache.resolve(client, "@ForAllQA") == InputPeerChannel(42, 111)
+    assert client.requests == ["forallqa"]
+    assert cache.cached("forallqa") == InputPeerChannel(42, 111)
+
+    # ==== 2. Свежая запись: без сети ====
+    await cache.resolve(client, "@forallqa")
+    assert len(client.requests) == 1
+
+    # ==== 3. Устаревшая запись перепроверяется в сети и получает новый access_hash ====
+    client.access_hash = 222
+    expire("forallqa")
+    assert await cache.resolve(client, "@forallqa") == InputPeerChannel(42, 222)
+    assert len(client.requests) == 2
+
+    # ==== 4. FloodWait при перепроверке: используется устаревшая запись ====
+    expire("forallqa")
+    client.flood = True
+    assert await cache.resolve(client, "@forallqa") == InputPeerChannel(42, 222)
+    client.flood = False
+
+    # ==== 5. После invalidate — снова сеть (повтор из session_pool.iter_channel) ====
+    client.access_hash = 333
+    cache.invalidate("@forallqa")
+    assert cache.cached("@forallqa") is None
+    assert await cache.resolve(client, "@forallqa") == InputPeerChannel(42, 333)
+
+    # ==== 6. Кэш привязан к сессии ====
+    assert PeerCache(conn, "other").cached("@forallqa") is None
+
+    # ==== 7. Ссылка t.me/name — тот же username; id и инвайт-ссылки — через get_input_entity ====
+    requests = len(client.requests)
+    assert await cache.resolve(client, "https://t.me/ForAllQA") == InputPeerChannel(42, 333)
+    assert len(client.requests) == requests
+    for channel in (-1001234, "-1001234", "https://t.me/+AbCdEf"):
+        assert await cache.resolve(client, channel) == InputPeerChannel(7, 777)
+    assert client.entities == [-1001234, "https://t.me/+AbCdEf"]
+    assert len(client.requests) == requests
+    assert cache.cached(-1001234) == InputPeerChannel(7, 777)
+
+
+asyncio.run(check_resolve())
+print("PeerCache OK")
@@ -0,0 +1,262 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+# tg_job_scan при импорте открывает jobwatcher.db и сессию Telethon в текущем
+# каталоге — импортируем его из временного каталога с копией config.yaml
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+tmp_dir = tempfile.mkdtemp(prefix="jobwatcher-test-")
+shutil.copy(os.path.join(REPO_DIR, "config.yaml"), tmp_dir)
+sys.path.insert(0, REPO_DIR)
+cwd = os.getcwd()
+os.chdir(tmp_dir)
+import tg_job_scan as scan
+import tg_job_watcher as watcher
+import tg_job_daemon as daemon
+os.chdir(cwd)
+
+from db import init_db, message_text, StemVocab, TextCodec
+from score import get_profiles
+from tg_job_rescore import rescore
+
+
+class StubClient:
+    """Вместо TelegramClient: запоминает отправленное, посты с fail_on в тексте не отправляет."""
+
+    def __init__(self, fail_on=None):
+        self.sent = []
+        self.fail_on = fail_on
+
+    def add_event_handler(self, callback, event=None):
+        pass
+
+    async def send_message(self, chat, text, **kwargs):
+        if self.fail_on and self.fail_on in text:
+            raise RuntimeError("send failed")
+        self.sent.append((chat, text))
+
+
+def post(name, final):
+    return {'profile': 'default', 'channel': '@ch', 'msg_id': 1, 'final': final,
+            'pos': final, 'neg': 0, 'summary': 'Хорошее совпадение', 'preview': name}
+
+
+def names(items):
+    return [item['preview'] for item in items]
+
+
+# ==== 1. TopK: порядок, вытеснение, равные рейтинги, ограничение памяти ====
+top = scan.TopK(3)
+for name, final in [("a", 1), ("b", 5), ("c", 3), ("d", 5), ("e", 2), ("f", 4), ("g", None)]:
+    top.push(post(name, final))
+    assert len(top._heap) <= 3, "heap grew beyond k"
+assert names(top.items()) == ["b", "d", "f"], names(top.items())
+
+# при равном рейтинге остаётся более ранний пост
+top = scan.TopK(2)
+for name in ["x", "y", "z"]:
+    top.push(post(name, 4))
+assert names(top.items()) == ["x", "y"], names(top.items())
+
+top = scan.TopK(0)
+top.push(post("a", 5))
+assert top.items() == []
+print("TopK OK")
+
+
+# ==== 2. ResultStream: счётчики, отчёты, notify_empty ====
+async def check_stream():
+    client = StubClient(fail_on="bad")
+    stream = scan.ResultStream(client, "chat", mode="stream", pause_sec=0)
+    await stream.emit(post("good", 3))
+    await stream.emit(post("bad", 2))
+    await stream.finish()
+    assert (stream.total, stream.sent, stream.failed) == (2, 1, 1)
+    assert len(stream.failed_items) == 1
+    texts = [text for _, text in client.sent]
+    assert texts[0].startswith("JobWatcher — потоковое сканирование")
+    assert "good" in texts[1]
+    assert "Отправлено: 1" in texts[-1] and "Не отправлено: 1" in texts[-1]
+    assert len(texts) == 3
+
+
+async def check_digest():
+    client = StubClient()
+    stream = scan.ResultStream(client, "chat", mode="digest", top_k=2, pause_sec=0)
+    for name, final in [("a", 1), ("b", 5), ("c", 3)]:
+        await stream.emit(post(name, final))
+    assert client.sent == [], "digest sent before finish()"
+    await stream.finish()
+    texts = [text for _, text in client.sent]
+    assert texts[0].startswith("JobWatcher — лучшие 2 из 3")
+    assert "b" in texts[1].split("Содержание сообщения")[1]
+    assert "c" in texts[2].split("Содержание сообщения")[1]
+    assert (stream.total, stream.sent, stream.failed) == (3, 2, 0)
+    assert len(texts) == 4
+
+
+async def check_empty():
+    client = StubClient()
+    await scan.ResultStream(client, "chat", pause_sec=0).finish()
+    assert [text for _, text in client.sent] == ["Ничего релевантного за период не найдено."]
+    client = StubClient()
+    await scan.ResultStream(client, "chat", mode="digest", pause_sec=0, notify_empty=False).finish()
+    assert client.sent == []
+
+
+asyncio.run(check_stream())
+asyncio.run(check_digest())
+asyncio.run(check_empty())
+print("ResultStream OK")
+
+
+# ==== 3. Пост, обработанный watcher, скан считает виденным (общий ключ seen) ====
+class FakePool:
+    sessions = [None]
+    failed = {}
+
+    def __init__(self, items):
+        self.items = items
+
+    async def stream(self, channels, since, limit):
+        for item in self.items:
+            yield item
+
+
+async def check_shared_key():
+    conn = init_db(os.path.join(tmp_dir, "shared.db"))
+    vocab, codec = StemVocab(conn), TextCodec(conn)
+    client = StubClient()
+    # как в демоне: живые уведомления идут в чат сканера
+    watcher.setup(client, conn, vocab, None, codec, target_chat=scan.TARGET_CHAT)
+    scan.conn, scan.vocab, scan.codec = conn, vocab, codec
+
+    text = "  Ищем QA engineer (middle), удалённо. Ручное тестирование API, Postman, SQL\n"
+    msg = SimpleNamespace(id=101, message=text, media=None, date=None)
+    # live: Telegram отдаёт username канала без "@" и в своём регистре
+    await watcher.newmsg_handler(SimpleNamespace(message=msg, chat=SimpleNamespace(username="ForAllQA")))
+    rows = conn.execute("SELECT count(*) FROM seen").fetchone()[0]
+    assert rows == len(scan.PROFILES) and len(client.sent) == 1
+    assert client.sent[0][0] == scan.TARGET_CHAT
+
+    # плановый скан: тот же пост из канала "@forallqa" конфига
+    scan.pool = FakePool([("@forallqa", msg)])
+    results = await scan.scan_history(client, hours=1)
+    assert results == [], "scan re-accepted a post already handled by the watcher"
+    assert conn.execute("SELECT count(*) FROM seen").fetchone()[0] == rows
+    conn.close()
+
+
+asyncio.run(check_shared_key())
+print("shared seen key OK")
+
+
+# ==== 4. Демон: сломанный канал не держит отметки остальных каналов ====
+class BrokenChannelPool(FakePool):
+
+    def __init__(self, broken):
+        super().__init__([])
+        self.broken = broken
+        self.since = None
+
+    async def stream(self, channels, since, limit):
+        self.since = since
+        self.failed = {self.broken: "CHANNEL_PRIVATE"}
+        for item in self.items:
+            yield item
+
+
+async def check_daemon_marks():
+    conn = init_db(os.path.join(tmp_dir, "daemon.db"))
+    scan.conn, scan.vocab, scan.codec, scan.client = conn, StemVocab(conn), TextCodec(conn), StubClient()
+    good, bad = scan.CHANNELS[0], scan.CHANNELS[1]
+    scan.pool = BrokenChannelPool(bad)
+
+    await daemon.scheduled_scan()
+    assert daemon.get_meta(conn, f"{daemon.LAST_SCAN_KEY}:{good}") is not None
+    assert daemon.get_meta(conn, f"{daemon.LAST_SCAN_KEY}:{bad}") is None
+
+    # через 2 часа: исправный канал сканируется за 2 ч (+ перекрытие), сломанный — со своей отметки
+    now = time.time()
+    for ch in scan.CHANNELS:
+        if ch != bad:
+            daemon.set_meta(conn, f"{daemon.LAST_SCAN_KEY}:{ch}", str(now - 2 * 3600))
+    daemon.set_meta(conn, f"{daemon.LAST_SCAN_KEY}:{bad}", str(now - 30 * 86400))
+    windows = daemon._catch_up_hours(now)
+    assert abs(windows[good] - (2 + daemon.SCAN_OVERLAP_HOURS)) < 0.01
+    assert windows[bad] == daemon.MAX_SCAN_HOURS
+    await daemon.scheduled_scan()
+    assert abs((scan.pool.since[good] - scan.pool.since[bad]).total_seconds() / 3600
+               - (daemon.MAX_SCAN_HOURS - windows[good])) < 0.01
+    assert float(daemon.get_meta(conn, f"{daemon.LAST_SCAN_KEY}:{good}")) >= now
+    assert float(daemon.get_meta(conn, f"{daemon.LAST_SCAN_KEY}:{bad}")) == now - 30 * 86400
+    conn.close()
+
+
+asyncio.run(check_daemon_marks())
+print("daemon marks OK")
+
+
+# ==== 5. Несколько профилей: текст и токены хранятся в одной строке сообщения ====
+async def check_text_once():
+    conn = init_db(os.path.join(tmp_dir, "profiles.db"))
+    scan.conn, scan.vocab, scan.codec = conn, StemVocab(conn), TextCodec(conn)
+    cfg = dict(scan.cfg, profiles={'aqa': {'target_chat_id': "aqa_chat"}})
+    profiles = scan.PROFILES
+    scan.PROFILES = get_profiles(cfg)
+    text = "Ищем QA engineer (middle), удалённо. Ручное тестирование API, Postman, SQL"
+    scan.pool = FakePool([("@forallqa", SimpleNamespace(id=7, message=text, media=None, date=None))])
+    try:
+        await scan.scan_history(StubClient(), hours=1)
+    finally:
+        scan.PROFILES = profiles
+    rows = conn.execute("SELECT profile, raw_text IS NOT NULL, tokens IS NOT NULL FROM seen ORDER BY rowid").fetchall()
+    assert rows == [('default', 1, 1), ('aqa', 0, 0)], rows
+    assert scan.codec.unpack(message_text(conn, "ForAllQA", 7)) == text
+
+    # пересчёт находит текст для строки без него; без токенов стеммит один раз
+    conn.execute("UPDATE seen SET tokens=NULL, tokens_ver=NULL, status='old'")
+    conn.commit()
+    stats = rescore(conn, cfg)
+    assert (stats['tokenized'], stats['from_tokens'], stats['skipped'], stats['changed']) == (1, 1, 0, 2), stats
+    assert conn.execute("SELECT count(*) FROM seen WHERE tokens IS NOT NULL").fetchone()[0] == 1
+    assert conn.execute("SELECT count(*) FROM seen WHERE status='old'").fetchone()[0] == 0
+    conn.close()
+
+
+asyncio.run(check_text_once())
+print("text once per message OK")
+
+
+# ==== 6. Демон: обслуживание БД в потоке со своим соединением, словарь сжатия подхватывается ====
+async def check_maintenance():
+    path = os.path.join(tmp_dir, "maintenance.db")
+    conn = init_db(path)
+    scan.DB_PATH, scan.conn, scan.codec = path, conn, TextCodec(conn)
+    text = "Ищем QA engineer (middle), удалённо. Ручное тестирование API, Postman, SQL.\n"
+    conn.executemany("INSERT INTO seen(msg_unique, channel, msg_id, raw_text) VALUES(?,?,?,?)",
+                     [(f"ch::{i}", "ch", i, f"{text}#{i}\n{text}") for i in range(60)])
+    conn.commit()
+    interval = daemon.MAINTENANCE_INTERVAL_SEC
+    daemon.MAINTENANCE_INTERVAL_SEC = 0
+    task = asyncio.create_task(daemon.maintenance_loop())
+    try:
+        for _ in range(500):
+            if scan.codec.dict_id:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        task.cancel()
+        daemon.MAINTENANCE_INTERVAL_SEC = interval
+    assert scan.codec.dict_id, "daemon codec did not pick up the trained dictionary"
+    assert conn.execute("SELECT count(*) FROM seen WHERE typeof(raw_text)='text'").fetchone()[0] == 0
+    assert scan.codec.unpack(conn.execute("SELECT raw_text FROM seen WHERE msg_id=7").fetchone()[0]) == f"{text}#7\n{text}"
+    conn.close()
+
+
+asyncio.run(check_maintenance())
+print("daemon maintenance OK")
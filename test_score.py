@@ -1,6 +1,6 @@
 import yaml
 from pathlib import Path
-from score import score_and_classify
+from score import score_and_classify, get_profiles, score_profiles, tokenize, cascade_mismatch
 from nltk.stem.snowball import SnowballStemmer
 
 
@@ -71,4 +71,33 @@ for i, txt in enumerate(test_texts, 1):
     print("final_score:", res['final_score'])
     print("positive_sum:", res['positive_sum'], ", negative_sum:", res['negative_sum'])
     print("summary:", res['summary'])
-    print("matches:", res['matches'])
\ No newline at end of file
+    print("matches:", res['matches'])
+
+# ==== 7. Несколько профилей за один проход ====
+multi_cfg = dict(cfg)
+multi_cfg["profiles"] = {
+    "aqa": {"markers": {"excellent_markers": ["aqa", "automation engineer"]}},
+}
+profiles = get_profiles(multi_cfg)
+for txt in test_texts:
+    by_profile = score_profiles(txt, profiles)
+    # профиль default должен совпадать с одиночным скорингом
+    assert by_profile["default"] == score_and_classify(txt, cfg), "default profile differs"
+    for name, res in by_profile.items():
+        print(f"profile {name}: final_score={res['final_score']} summary={res['summary']}")
+
+# ==== 8. Скоринг по сохранённым токенам совпадает со скорингом по тексту ====
+for txt in test_texts:
+    assert score_and_classify(None, cfg, tokens=tokenize(txt)) == score_and_classify(txt, cfg), "tokens path differs"
+print("tokens path OK")
+
+# ==== 9. Каскад: префильтр ignore не меняет результат ====
+cascade_texts = test_texts + [
+    "Реклама. Курсы для тестировщиков со скидкой",
+    "Подборки вакансий: QA engineer, SQL, Postman",
+    "Backend-developer ++ developers, стажёры и ГЕЙМИНГ",
+    "#курсы по API testing, gaming и crypto",
+]
+for txt in cascade_texts:
+    assert cascade_mismatch(txt, cfg) is None, f"cascade differs: {txt!r}"
+print("cascade OK")
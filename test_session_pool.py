@@ -0,0 +1,145 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from telethon.errors import FloodWaitError
+
+from session_pool import PoolSession, RateLimiter, SessionPool
+
+NOW = datetime.utcnow()
+
+
+class FakePeerCache:
+
+    def __init__(self):
+        self.invalidated = []
+        self.resolved = []
+
+    def cached(self, channel):
+        return None
+
+    def invalidate(self, channel):
+        self.invalidated.append(channel)
+
+    async def resolve(self, client, channel):
+        self.resolved.append(channel)
+        return f"peer:{channel}"
+
+
+class FakeClient:
+    """Канал из сообщений с id total..1 (новые — с большим id), по часу между сообщениями."""
+
+    def __init__(self, total=250, errors=None):
+        self.total = total
+        self.errors = list(errors or [])  # исключения для первых вызовов get_messages
+        self.calls = []
+
+    async def get_messages(self, entity, limit, offset_id=0):
+        self.calls.append((entity, limit, offset_id))
+        if self.errors:
+            raise self.errors.pop(0)
+        top = offset_id - 1 if offset_id else self.total
+        return [SimpleNamespace(id=i, date=NOW - timedelta(hours=self.total - i))
+                for i in range(top, max(top - limit, 0), -1)]
+
+
+def make_pool(names, clients=None):
+    clients = clients or {}
+    return SessionPool([PoolSession(name, clients.get(name) or FakeClient(), FakePeerCache(), requests_per_sec=0)
+                        for name in names])
+
+
+def primaries(pool, channels):
+    return {ch: pool.candidates(ch)[0].name for ch in channels}
+
+
+async def collect(pool, channel, since, limit):
+    return [msg.id async for msg in pool.iter_channel(channel, since, limit)]
+
+
+CHANNELS = [f"@channel_{i}" for i in range(300)]
+
+# ==== 1. Кольцо: candidates — все сессии по разу, канал нормализуется ====
+pool = make_pool(["a", "b", "c"])
+for ch in CHANNELS[:20]:
+    order = [s.name for s in pool.candidates(ch)]
+    assert sorted(order) == ["a", "b", "c"], order
+    assert order == [s.name for s in pool.candidates(ch)]
+assert pool.candidates("@Channel_7") == pool.candidates("channel_7")
+assert pool.candidates(-1001234) == pool.candidates("-1001234")
+assert len(set(primaries(pool, CHANNELS).values())) == 3
+
+# ==== 2. Стабильность: новая сессия забирает каналы только себе, удаление — только свои ====
+before = primaries(pool, CHANNELS)
+after = primaries(make_pool(["a", "b", "c", "d"]), CHANNELS)
+moved = [ch for ch in CHANNELS if before[ch] != after[ch]]
+assert all(after[ch] == "d" for ch in moved), "channels moved between old sessions"
+assert 0 < len(moved) < len(CHANNELS) / 2, len(moved)
+without_b = primaries(make_pool(["a", "c"]), CHANNELS)
+assert all(without_b[ch] == before[ch] for ch in CHANNELS if before[ch] != "b")
+print("ring OK")
+
+
+async def check_iter():
+    # ==== 3. Постраничное чтение до since и до limit ====
+    pool = make_pool(["a"])
+    ids = await collect(pool, "@ch", NOW - timedelta(hours=149.5), 1000)
+    assert ids == list(range(250, 100, -1)), ids[-3:]
+    assert await collect(pool, "@ch", NOW - timedelta(days=30), 120) == list(range(250, 130, -1))
+
+    # ==== 4. FloodWait: сессия блокируется, канал дочитывает следующая с того же offset_id ====
+    flooded = FakeClient()
+    orig = flooded.get_messages
+
+    async def flood_after_first_page(entity, limit, offset_id=0):
+        if offset_id:
+            raise FloodWaitError(request=None, capture=60)
+        return await orig(entity, limit, offset_id)
+    flooded.get_messages = flood_after_first_page
+
+    first = make_pool(["a", "b"]).candidates("@ch")[0].name
+    pool = make_pool(["a", "b"], {first: flooded})
+    primary, backup = pool.candidates("@ch")
+
+    ids = await collect(pool, "@ch", NOW - timedelta(days=30), 1000)
+    assert ids == list(range(250, 0, -1)), "messages lost or duplicated on failover"
+    assert primary.blocked_until > time.monotonic() + 50
+    assert backup.client.calls[0][2] == 151, backup.client.calls[0]
+
+    # ==== 5. Отвергнутый peer: инвалидация и повторное разрешение, один раз на сессию ====
+    pool = make_pool(["a"], {"a": FakeClient(total=5, errors=[ValueError("Could not find the input entity")])})
+    assert await collect(pool, "@ch", NOW - timedelta(days=1), 100) == [5, 4, 3, 2, 1]
+    sess = pool.sessions[0]
+    assert sess.peer_cache.invalidated == ["@ch"] and sess.peer_cache.resolved == ["@ch", "@ch"]
+
+    # ==== 6. stream: каналы сливаются в один поток, сломанный канал попадает в failed ====
+    pool = make_pool(["a", "b"], {"a": FakeClient(errors=[ValueError("private")] * 2), "b": FakeClient(total=3)})
+    good = next(ch for ch in CHANNELS if pool.candidates(ch)[0].name == "b")
+    bad = next(ch for ch in CHANNELS if pool.candidates(ch)[0].name == "a")
+    since = {good: NOW - timedelta(days=1), bad: NOW - timedelta(days=1)}
+    got = [(ch, msg.id) async for ch, msg in pool.stream([good, bad], since, 100)]
+    assert got == [(good, 3), (good, 2), (good, 1)], got
+    assert list(pool.failed) == [bad]
+
+
+asyncio.run(check_iter())
+print("iter_channel/stream OK")
+
+
+# ==== 7. RateLimiter: равномерно не чаще per_sec; per_sec <= 0 — без ограничения ====
+async def check_limiter():
+    limiter = RateLimiter(20)
+    started = time.monotonic()
+    for _ in range(5):
+        await limiter.acquire()
+    assert time.monotonic() - started >= 4 / 20 - 0.01
+    limiter = RateLimiter(0)
+    started = time.monotonic()
+    for _ in range(100):
+        await limiter.acquire()
+    assert time.monotonic() - started < 0.05
+
+
+asyncio.run(check_limiter())
+print("RateLimiter OK")
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import tempfile
+
+from telethon.errors import MessageNotModifiedError
+
+import tg_job_watcher as watcher
+from db import init_db
+
+tmp_dir = tempfile.mkdtemp(prefix="jobwatcher-test-")
+
+
+class StubClient:
+
+    def add_event_handler(self, callback, event=None):
+        pass
+
+
+class StubEvent:
+    """Вместо events.CallbackQuery.Event: запоминает ответы и правки кнопок."""
+
+    def __init__(self, data, not_modified=False):
+        self.data = data
+        self.answers = []
+        self.edits = []
+        self.not_modified = not_modified
+
+    async def answer(self, message=None, alert=False):
+        self.answers.append((message, alert))
+
+    async def edit(self, buttons=None):
+        if self.not_modified:
+            raise MessageNotModifiedError(request=None)
+        self.edits.append(buttons)
+
+
+def labels(buttons):
+    return [button.text for row in buttons for button in row]
+
+
+def status(rowid):
+    return conn.execute("SELECT status FROM seen WHERE rowid=?", (rowid,)).fetchone()[0]
+
+
+conn = init_db(os.path.join(tmp_dir, "test.db"))
+watcher.setup(StubClient(), conn)
+watcher.STATUS_FLUSH_SEC = 0.05
+conn.executemany(
+    "INSERT INTO seen(msg_unique, channel, msg_id, status) VALUES(?,?,?,?)",
+    [("forallqa::пост 1", "forallqa", 10, "Хорошее совпадение"),
+     ("qa_work::пост 2", "qa_work", 20, "Хорошее совпадение")]
+)
+conn.commit()
+first, second = [rowid for (rowid,) in conn.execute("SELECT rowid FROM seen ORDER BY rowid")]
+
+# ==== 1. Кнопки: payload "<команда>:<rowid>", выбранная отмечена ✅ ====
+buttons = watcher._buttons(first, "Сохранено")
+assert [button.type.data for row in buttons for button in row] == [f"{cmd}:{first}".encode() for cmd in "asv"]
+assert labels(buttons) == ["Отклик", "Пропустить", "✅ Сохранить"]
+print("buttons OK")
+
+
+async def check_callback():
+    # ==== 2. a:<rowid>: статус копится, кнопки правятся на месте ====
+    event = StubEvent(f"a:{first}".encode())
+    await watcher.callback(event)
+    assert event.answers == [("Отмечено: Откликнулся", False)]
+    assert labels(event.edits[0]) == ["✅ Отклик", "Пропустить", "Сохранить"]
+    assert watcher._pending_status == {first: "Откликнулся"}
+    assert status(first) == "Хорошее совпадение", "status written before flush"
+
+    # ==== 3. Старый формат apply:<msg_id>:<channel>; сообщение не изменилось — не ошибка ====
+    event = StubEvent(b"skip:20:qa_work", not_modified=True)
+    await watcher.callback(event)
+    assert event.answers == [("Отмечено: Неинтересно", False)] and event.edits == []
+    # повторное нажатие той же строки до сброса перезаписывает статус в очереди
+    await watcher.callback(StubEvent(f"v:{first}".encode()))
+    assert watcher._pending_status == {first: "Сохранено", second: "Неинтересно"}
+
+    # ==== 4. Пачка пишется в БД одним сбросом через STATUS_FLUSH_SEC ====
+    await asyncio.sleep(watcher.STATUS_FLUSH_SEC * 3)
+    assert watcher._pending_status == {}
+    assert (status(first), status(second)) == ("Сохранено", "Неинтересно")
+
+    # ==== 5. Неизвестные данные и отсутствующая строка ====
+    for data in (b"", b"x:1", b"a:abc", b"apply:1", None):
+        event = StubEvent(data)
+        await watcher.callback(event)
+        assert event.answers == [(None, False)] and event.edits == [], data
+    for data in (b"a:999", b"apply:99:forallqa"):
+        event = StubEvent(data)
+        await watcher.callback(event)
+        assert event.answers == [("Не удалось найти запись в БД для этого сообщения.", True)], data
+        assert event.edits == []
+    assert watcher._pending_status == {}
+
+
+asyncio.run(check_callback())
+
+# ==== 6. flush_status без накопленного — ничего не делает; накопленное пишется сразу ====
+watcher.flush_status()
+watcher._pending_status[first] = "Откликнулся"
+watcher.flush_status()
+assert status(first) == "Откликнулся" and watcher._pending_status == {}
+conn.close()
+print("callback OK")
@@ -0,0 +1,114 @@
+# tg_job_daemon.py — один долгоживущий процесс вместо tg_job_watcher.py + cron с tg_job_scan.py
+# Запуск: python tg_job_daemon.py
+#
+# Один Telethon-клиент, одно соединение с jobwatcher.db и один скоринг на оба режима:
+# - live: обработчики tg_job_watcher (новые сообщения, inline-кнопки);
+# - каждые daemon.scan_interval_min минут догоняющий скан tg_job_scan: каждый канал
+#   за время с его прошлого удачного скана (отметки по каналам в таблице meta), без
+#   вопросов в консоли; недоступный канал не держит окно остальных;
+# - каждые storage.maintenance_interval_hours часов обслуживание БД (tg_job_maintain).
+# Live и сканы работают в одном event loop на одном соединении, поэтому их записи в БД
+# не конкурируют за блокировку; обслуживание (на старой БД — сжатие всей таблицы)
+# идёт в отдельном потоке со своим соединением и короткими транзакциями.
+
+import asyncio
+import time
+
+import tg_job_scan as scan
+import tg_job_watcher as watcher
+from db import init_db, get_meta, set_meta, TextCodec
+from tg_job_maintain import run_maintenance
+
+DAEMON_CFG = scan.cfg.get("daemon") or {}
+SCAN_INTERVAL_SEC = float(DAEMON_CFG.get("scan_interval_min", 60)) * 60
+FIRST_SCAN_HOURS = float(DAEMON_CFG.get("first_scan_hours", 24))
+MAX_SCAN_HOURS = float(DAEMON_CFG.get("max_scan_hours", 168))
+SCAN_OVERLAP_HOURS = 0.25  # перекрытие окон; дубли отсекает seen
+
+LAST_SCAN_KEY = "daemon_last_scan_ts"  # + ":<канал>"; без суффикса — общая отметка прежних версий
+
+STORAGE_CFG = scan.cfg.get("storage") or {}
+MAINTENANCE_INTERVAL_SEC = float(STORAGE_CFG.get("maintenance_interval_hours", 24)) * 3600
+
+
+def _catch_up_hours(now: float) -> dict:
+    """Окна следующего скана по каналам: от прошлого удачного скана канала (с перекрытием), не больше MAX_SCAN_HOURS."""
+    legacy = get_meta(scan.conn, LAST_SCAN_KEY)
+    windows = {}
+    for ch in scan.CHANNELS:
+        last = get_meta(scan.conn, f"{LAST_SCAN_KEY}:{ch}") or legacy
+        if last is None:
+            windows[ch] = FIRST_SCAN_HOURS
+        else:
+            windows[ch] = min((now - float(last)) / 3600 + SCAN_OVERLAP_HOURS, MAX_SCAN_HOURS)
+    return windows
+
+
+async def scheduled_scan():
+    started = time.time()
+    windows = _catch_up_hours(started)
+    hours = max(windows.values(), default=FIRST_SCAN_HOURS)
+    print(f"[daemon] Плановый скан за {min(windows.values(), default=hours):.2f}–{hours:.2f} ч…")
+    try:
+        await scan.fetch_messages(hours, notify_empty=False, channel_hours=windows)
+    except Exception as e:
+        # следующий скан захватит пропущенное окно: отметки не сдвинулись
+        print(f"[daemon] Ошибка планового скана: {e}")
+        return
+    if scan.pool.failed:
+        # недочитанные каналы догоним в следующий раз с их собственной отметки
+        print(f"[daemon] Не дочитаны: {', '.join(map(str, scan.pool.failed))}")
+    for ch in scan.CHANNELS:
+        if ch not in scan.pool.failed:
+            set_meta(scan.conn, f"{LAST_SCAN_KEY}:{ch}", str(started))
+
+
+async def scan_loop():
+    while True:
+        await scheduled_scan()
+        await asyncio.sleep(SCAN_INTERVAL_SEC)
+
+
+MAINTENANCE_BUSY_TIMEOUT_MS = 30000  # ждать, пока live/скан закоммитят свою запись
+
+
+def _maintenance() -> dict:
+    """run_maintenance в потоке executor'а: своё соединение, event loop не блокируется."""
+    conn = init_db(scan.DB_PATH)
+    try:
+        conn.execute(f"PRAGMA busy_timeout={MAINTENANCE_BUSY_TIMEOUT_MS}")
+        return run_maintenance(conn, TextCodec(conn, enabled=scan.codec.enabled), scan.cfg)
+    finally:
+        conn.close()
+
+
+async def maintenance_loop():
+    while True:
+        await asyncio.sleep(MAINTENANCE_INTERVAL_SEC)
+        try:
+            watcher.flush_status()
+            await asyncio.get_running_loop().run_in_executor(None, _maintenance)
+            # обслуживание могло обучить новый словарь сжатия — новые записи сжимаются им
+            scan.codec.reload()
+        except Exception as e:
+            print(f"[daemon] Ошибка обслуживания БД: {e}")
+
+
+async def main():
+    watcher.setup(scan.client, scan.conn, scan.vocab, scan.peer_cache, scan.codec, target_chat=scan.TARGET_CHAT)
+    await scan.client.start(phone=scan.PHONE)
+    await scan.pool.start()
+    await watcher.start_watching()
+
+    tasks = [asyncio.create_task(scan_loop()), asyncio.create_task(maintenance_loop())]
+    try:
+        await scan.client.run_until_disconnected()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await scan.pool.disconnect()
+        watcher.flush_status()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,168 @@
+# tg_job_export.py — выгрузка оценённой истории seen в колоночный формат для аналитики
+# Запуск: python tg_job_export.py [--full] [--with-text]
+# Нужен pyarrow (pip install pyarrow); остальным скриптам он не нужен.
+#
+# Каждая строка seen -> строка таблицы; matches раскладываются по категориям
+# в типизированные колонки (excellent: list<string>, n_excellent: int16, ...),
+# JSON в аналитике больше не парсится. Раскладка каталогов — hive:
+#   <export.dir>/date=2026-10-19/channel=forallqa/part-000000001234-0.parquet
+# Инкрементально: выгружаются только строки с rowid больше отметки в meta,
+# новые файлы дописываются рядом со старыми. Повтор прерванного запуска
+# перезаписывает те же файлы (имя — по первому rowid пачки), дублей нет.
+# Статусы, изменённые кнопками после выгрузки, попадут только в --full
+# (в пустой каталог). Если включён storage.retention_days, выгружать нужно чаще:
+# у строк после ретеншна matches уже удалены.
+#
+# Чтение:
+#   import pyarrow.dataset as ds
+#   t = ds.dataset("export", format="parquet", partitioning="hive").to_table(
+#       filter=ds.field("date") >= "2026-10-01")
+# Для format: arrow — format="ipc"; файлы Arrow IPC читаются через memory-map.
+
+import os
+import sys
+import json
+import yaml
+from datetime import datetime, timezone
+
+from db import init_db, get_meta, set_meta, row_profile, channel_key, message_text, TextCodec
+from score import get_profiles
+
+DB_PATH = os.getenv("DB_PATH", "jobwatcher.db")
+
+CATEGORIES = ('excellent', 'acceptable', 'negative', 'strong_negative', 'ignore')
+FORMATS = {'parquet': 'parquet', 'arrow': 'ipc'}  # export.format -> формат pyarrow.dataset
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+    except ImportError:
+        sys.exit("[export] нужен pyarrow: pip install pyarrow")
+    return pyarrow, pyarrow.dataset
+
+
+def _schema(pa, with_text: bool):
+    fields = [
+        ('rowid', pa.int64()),
+        ('profile', pa.string()),
+        ('msg_id', pa.int64()),
+        ('status', pa.string()),
+        ('score', pa.int32()),
+        ('pos_sum', pa.int32()),
+        ('neg_sum', pa.int32()),
+        ('first_seen', pa.timestamp('s', tz='UTC')),
+    ]
+    fields += [(f"n_{cat}", pa.int16()) for cat in CATEGORIES]
+    fields += [(cat, pa.list_(pa.string())) for cat in CATEGORIES]
+    if with_text:
+        fields.append(('text', pa.string()))
+    # ключи партиций: в файлы не пишутся, восстанавливаются из путей
+    fields += [('date', pa.string()), ('channel', pa.string())]
+    return pa.schema(fields)
+
+
+def _marker(entry) -> str:
+    """Маркер из элемента matches; старый watcher хранил пары [маркер, предложение]."""
+    if isinstance(entry, (list, tuple)):
+        entry = entry[0] if entry else ""
+    return str(entry)
+
+
+def _columns(conn, rows, codec: TextCodec, names, with_text: bool) -> dict:
+    cols = {name: [] for name in ('rowid', 'profile', 'msg_id', 'status', 'score', 'pos_sum', 'neg_sum', 'first_seen')}
+    for cat in CATEGORIES:
+        cols[f"n_{cat}"] = []
+        cols[cat] = []
+    if with_text:
+        cols['text'] = []
+    cols['date'] = []
+    cols['channel'] = []
+
+    for rowid, unique, profile, channel, msg_id, status, score, pos_sum, neg_sum, matches, raw_text, ts in rows:
+        matches = codec.unpack(matches)
+        matches = json.loads(matches) if matches else {}
+        seen_at = datetime.fromtimestamp(ts or 0, tz=timezone.utc)
+        cols['rowid'].append(rowid)
+        cols['profile'].append(row_profile(profile, unique, channel, names))
+        cols['msg_id'].append(msg_id)
+        cols['status'].append(status)
+        cols['score'].append(score)
+        cols['pos_sum'].append(pos_sum)
+        cols['neg_sum'].append(neg_sum)
+        cols['first_seen'].append(seen_at)
+        for cat in CATEGORIES:
+            found = [_marker(m) for m in matches.get(cat) or []]
+            cols[f"n_{cat}"].append(len(found))
+            cols[cat].append(found)
+        if with_text:
+            if raw_text is None and msg_id is not None:
+                raw_text = message_text(conn, channel, msg_id)
+            cols['text'].append(codec.unpack(raw_text))
+        cols['date'].append(seen_at.strftime("%Y-%m-%d"))
+        cols['channel'].append(channel_key(channel))
+    return cols
+
+
+def export(conn, cfg: dict, full: bool = False, with_text: bool = None) -> dict:
+    """Выгружает строки seen новее отметки; возвращает статистику."""
+    pa, ds = _require_pyarrow()
+    opts = cfg.get("export") or {}
+    out_dir = opts.get("dir", "export")
+    fmt = opts.get("format", "parquet")
+    if fmt not in FORMATS:
+        raise ValueError(f"export.format: {fmt!r}, ожидается одно из {sorted(FORMATS)}")
+    if with_text is None:
+        with_text = bool(opts.get("with_text", False))
+    batch_rows = int(opts.get("batch_rows", 50000))
+    ext = "parquet" if fmt == "parquet" else "arrow"
+
+    mark_key = f"export_last_rowid:{fmt}:{os.path.abspath(out_dir)}"
+    if full:
+        if os.path.isdir(out_dir) and os.listdir(out_dir):
+            raise ValueError(f"--full пишет в пустой каталог, а {out_dir} не пуст")
+        last = 0
+    else:
+        last = int(get_meta(conn, mark_key) or 0)
+
+    codec = TextCodec(conn)
+    names = [p['name'] for p in get_profiles(cfg)]
+    schema = _schema(pa, with_text)
+    partitioning = ds.partitioning(pa.schema([schema.field('date'), schema.field('channel')]), flavor="hive")
+    stats = {'rows': 0, 'batches': 0, 'last_rowid': last}
+
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, msg_unique, profile, channel, msg_id, status, score, pos_sum, neg_sum, matches, raw_text, first_seen_ts "
+            "FROM seen WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last, batch_rows)
+        ).fetchall()
+        if not rows:
+            break
+        table = pa.Table.from_pydict(_columns(conn, rows, codec, names, with_text), schema=schema)
+        ds.write_dataset(
+            table, out_dir, format=FORMATS[fmt], partitioning=partitioning,
+            basename_template=f"part-{rows[0][0]:012d}-{{i}}.{ext}",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        last = rows[-1][0]
+        set_meta(conn, mark_key, str(last))
+        stats['rows'] += len(rows)
+        stats['batches'] += 1
+        stats['last_rowid'] = last
+    return stats
+
+
+def main():
+    with open("config.yaml", "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+    args = sys.argv[1:]
+    conn = init_db(DB_PATH)
+    stats = export(conn, cfg, full="--full" in args, with_text=True if "--with-text" in args else None)
+    print(f"[export] {stats}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# tg_job_maintain.py — обслуживание jobwatcher.db: сжатие, ретеншн, incremental VACUUM
+# Запуск: python tg_job_maintain.py [--retrain]
+# (tg_job_daemon.py вызывает run_maintenance по расписанию storage.maintenance_interval_hours)
+#
+# 1. если словаря сжатия ещё нет (или --retrain) — обучить его на текстах seen;
+# 2. сжать ещё не сжатые raw_text/matches;
+# 3. только если задан storage.retention_days > 0 (по умолчанию 0, выключено):
+#    строки старше него свести к отпечатку и оценкам — тексты удаляются необратимо;
+# 4. вернуть ОС до storage.vacuum_pages свободных страниц (только БД с auto_vacuum=INCREMENTAL;
+#    старые БД полным VACUUM не переводятся — он может перенумеровать rowid seen).
+
+import os
+import sys
+import yaml
+
+from db import init_db, TextCodec, train_dict, recompress, compact_old_rows, incremental_vacuum
+
+DB_PATH = os.getenv("DB_PATH", "jobwatcher.db")
+
+MIN_TRAIN_ROWS = 50  # меньше — словарь только навредит
+
+
+def _db_size(conn) -> int:
+    return conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+
+
+def run_maintenance(conn, codec: TextCodec, cfg: dict, retrain: bool = False) -> dict:
+    storage = cfg.get("storage") or {}
+    stats = {'size_before': _db_size(conn)}
+
+    if codec.enabled:
+        texts = conn.execute("SELECT count(*) FROM seen WHERE raw_text IS NOT NULL").fetchone()[0]
+        if (retrain or not codec.dict_id) and texts >= MIN_TRAIN_ROWS:
+            stats['dict_id'] = train_dict(conn, codec)
+        stats['recompressed'] = recompress(conn, codec)
+
+    retention_days = float(storage.get("retention_days", 0) or 0)
+    if retention_days > 0:
+        stats['compacted'] = compact_old_rows(conn, retention_days)
+
+    stats['free_pages'] = incremental_vacuum(conn, int(storage.get("vacuum_pages", 2000)))
+    if stats['free_pages'] is None:
+        print("[maintain] БД создана без auto_vacuum=INCREMENTAL — incremental VACUUM пропущен "
+              "(полный VACUUM может перенумеровать rowid seen, на них ссылаются кнопки)")
+    stats['size_after'] = _db_size(conn)
+    print(f"[maintain] {stats}")
+    return stats
+
+
+def main():
+    with open("config.yaml", "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+    conn = init_db(DB_PATH)
+    codec = TextCodec(conn, enabled=bool((cfg.get("storage") or {}).get("compress", True)))
+    run_maintenance(conn, codec, cfg, retrain="--retrain" in sys.argv[1:])
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# tg_job_rescore.py — пересчёт скоринга истории seen по текущему config.yaml
+# Запуск: python tg_job_rescore.py [--dry-run] [--check-cascade]
+#
+# Берёт сохранённые токены (seen.tokens) и не вызывает NLTK; сообщения без токенов
+# или с токенами старой версии токенизатора стеммятся из raw_text один раз,
+# и их токены дописываются в БД. Текст и токены сообщения хранятся в одной из его
+# строк по профилям, остальные строки берут их оттуда (по каналу и msg_id).
+# --check-cascade: вместо пересчёта прогоняет raw_text истории через каскад
+# (префильтр ignore + полный движок) и печатает расхождения, если они есть.
+
+import os
+import sys
+import json
+import yaml
+
+from db import init_db, row_profile, channel_key, StemVocab, TextCodec
+from score import get_profiles, score_and_classify, cascade_mismatch, tokenize, TOKENIZER_VERSION
+
+DB_PATH = os.getenv("DB_PATH", "jobwatcher.db")
+
+# статусы, выставленные пользователем кнопками, — их пересчёт не трогает
+USER_STATUSES = {'Откликнулся', 'Неинтересно', 'Сохранено'}
+
+
+def rescore(conn, cfg, dry_run: bool = False) -> dict:
+    vocab = StemVocab(conn)
+    codec = TextCodec(conn, enabled=bool((cfg.get("storage") or {}).get("compress", True)))
+    profiles = {p['name']: p for p in get_profiles(cfg)}
+    stats = {'rows': 0, 'from_tokens': 0, 'tokenized': 0, 'skipped': 0, 'changed': 0}
+
+    rows = conn.execute(
+        "SELECT msg_unique, profile, channel, msg_id, status, score, raw_text, tokens, tokens_ver FROM seen"
+    ).fetchall()
+    # текст и токены сообщения лежат в одной из его строк по профилям (в старых
+    # БД — в каждой): собираем их по (канал, msg_id)
+    messages = {}
+    for unique, _, channel, msg_id, _, _, raw_text, blob, ver in rows:
+        if raw_text is None and blob is None:
+            continue
+        msg = messages.setdefault((channel_key(channel), msg_id), {'text': None, 'holder': None, 'tokens': None})
+        if msg['text'] is None and raw_text is not None:
+            msg['text'], msg['holder'] = raw_text, unique
+        if msg['tokens'] is None:
+            msg['tokens'] = vocab.decode(blob, ver)
+
+    for unique, profile, channel, msg_id, status, old_score, *_ in rows:
+        stats['rows'] += 1
+        prof = profiles.get(row_profile(profile, unique, channel, profiles))
+        msg = messages.get((channel_key(channel), msg_id))
+        if prof is None or msg is None:
+            stats['skipped'] += 1
+            continue
+
+        tokens = msg['tokens']
+        if tokens is not None:
+            stats['from_tokens'] += 1
+        elif msg['text'] is not None:
+            tokens = msg['tokens'] = tokenize(codec.unpack(msg['text']))
+            stats['tokenized'] += 1
+            if not dry_run:
+                conn.execute(
+                    "UPDATE seen SET tokens=?, tokens_ver=? WHERE msg_unique=?",
+                    (vocab.encode(tokens), TOKENIZER_VERSION, msg['holder'])
+                )
+        else:
+            stats['skipped'] += 1
+            continue
+
+        res = score_and_classify(None, prof, tokens=tokens)
+        final = res.get('final_score')
+        summary = res.get('summary')
+        new_status = status
+        if status not in USER_STATUSES:
+            new_status = summary if final is not None else 'Отброшено'
+        if final != old_score or new_status != status:
+            stats['changed'] += 1
+        if not dry_run:
+            conn.execute(
+                "UPDATE seen SET profile=?, status=?, score=?, pos_sum=?, neg_sum=?, matches=? WHERE msg_unique=?",
+                (prof['name'], new_status, final, res.get('positive_sum', 0), res.get('negative_sum', 0),
+                 codec.pack(json.dumps(res.get('matches', {}), ensure_ascii=False)), unique)
+            )
+    if not dry_run:
+        conn.commit()
+    return stats
+
+
+def check_cascade(conn, cfg) -> dict:
+    """Сравнивает каскад с полным движком на raw_text всех строк seen (по всем профилям)."""
+    profiles = get_profiles(cfg)
+    codec = TextCodec(conn)
+    stats = {'texts': 0, 'mismatches': 0}
+    for (value,) in conn.execute("SELECT DISTINCT raw_text FROM seen WHERE raw_text IS NOT NULL"):
+        raw_text = codec.unpack(value)
+        stats['texts'] += 1
+        for prof in profiles:
+            diff = cascade_mismatch(raw_text, prof)
+            if diff is not None:
+                stats['mismatches'] += 1
+                fast, full = diff
+                print(f"[rescore] CASCADE MISMATCH ({prof['name']}): {fast['summary']!r} vs {full['summary']!r}: {raw_text[:120]!r}")
+    return stats
+
+
+def main():
+    with open("config.yaml", "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+    dry_run = "--dry-run" in sys.argv[1:]
+    conn = init_db(DB_PATH)
+    if "--check-cascade" in sys.argv[1:]:
+        print(f"[rescore] cascade check: {check_cascade(conn, cfg)}")
+        conn.close()
+        return
+    stats = rescore(conn, cfg, dry_run=dry_run)
+    print(f"[rescore] {'(dry-run) ' if dry_run else ''}{stats}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
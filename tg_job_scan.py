@@ -1,14 +1,18 @@
 import os
+import sys
 import json
 import yaml
-import sqlite3
 
 import asyncio
+import heapq
 from datetime import datetime, timedelta
 from telethon import TelegramClient
 from pathlib import Path
 from dotenv import load_dotenv
-from score import score_and_classify
+from score import get_profiles, score_and_tokenize, TOKENIZER_VERSION
+from db import init_db, is_seen, unique_key, StemVocab, TextCodec
+from peers import PeerCache, DEFAULT_TTL_SEC
+from session_pool import PoolSession, SessionPool
 from collections import Counter
 # -----
 
@@ -35,7 +39,7 @@ def format_post_block(item: dict) -> str:
     channel = item.get('channel', '')
     msg_id = item.get('msg_id')
     # ссылка на пост
-    channel_name = channel.replace('@', '')
+    channel_name = str(channel).replace('@', '')
     post_link = f"https://t.me/{channel_name}/{msg_id}"
     # рейтинг
     pos = item.get('pos', 0)
@@ -100,28 +104,20 @@ with open(config_path, "r", encoding="utf-8") as f:
     cfg = yaml.safe_load(f)
 
 CHANNELS = cfg.get("channels", [])
+PROFILES = get_profiles(cfg)
+SCAN_CFG = cfg.get("scan") or {}
+
+DEBUG = bool(os.getenv("SCAN_DEBUG"))
 
 
 # ================= 3.0 - Database initialization =================
-conn = sqlite3.connect(DB_PATH)
+# создаёт таблицу seen (и недостающие колонки), если не существует
+conn = init_db(DB_PATH)
 c = conn.cursor()
-
-# создаём таблицу заново, если не существует
-c.execute("""
-CREATE TABLE IF NOT EXISTS seen (
-    msg_unique TEXT PRIMARY KEY,
-    channel TEXT,
-    msg_id INTEGER,
-    status TEXT,
-    score INTEGER,
-    pos_sum INTEGER,
-    neg_sum INTEGER,
-    matches TEXT,
-    raw_text TEXT,
-    first_seen_ts INTEGER
-)
-""")
-conn.commit()
+vocab = StemVocab(conn)
+codec = TextCodec(conn, enabled=bool((cfg.get("storage") or {}).get("compress", True)))
+PEER_TTL_SEC = int(cfg.get("peer_cache_ttl_hours", DEFAULT_TTL_SEC // 3600)) * 3600
+peer_cache = PeerCache(conn, SESSION, ttl_sec=PEER_TTL_SEC)
 
 # проверка колонок (debug)
 cols = [t[1] for t in c.execute("PRAGMA table_info(seen)")]
@@ -131,33 +127,66 @@ print("DEBUG: columns in 'seen' table:", cols)
 # ================= 4.0 TELETHON =================
 client = TelegramClient(SESSION, API_ID, API_HASH)
 
+# Пул сессий для сканирования: основной client + аккаунты из cfg['session_pool']['sessions'].
+# Каналы делятся между сессиями по кольцу, у каждой свой лимит запросов и кэш peers.
+POOL_CFG = cfg.get("session_pool") or {}
+POOL_RPS = float(POOL_CFG.get("requests_per_sec", 1.0))
+pool_sessions = [PoolSession(SESSION, client, peer_cache, POOL_RPS, phone=PHONE)]
+for extra in POOL_CFG.get("sessions") or []:
+    pool_sessions.append(PoolSession(
+        extra["session"],
+        TelegramClient(extra["session"], int(extra.get("api_id", API_ID)), extra.get("api_hash", API_HASH)),
+        PeerCache(conn, extra["session"], ttl_sec=PEER_TTL_SEC),
+        float(extra.get("requests_per_sec", POOL_RPS)),
+        phone=extra.get("phone"),
+    ))
+pool = SessionPool(pool_sessions)
+
 
 # ================= 4.0 SCAN HISTORY =================
-async def scan_history(client: TelegramClient, hours: int = 24, limit_per_channel: int = 2000):
-    since = datetime.utcnow() - timedelta(hours=hours)
+async def scan_history(client: TelegramClient, hours: int = 24, limit_per_channel: int = 2000, on_result=None,
+                       channel_hours: dict = None):
+    """
+    Сканирует CHANNELS за последние hours часов
+    (channel_hours — свои окна для отдельных каналов, как у догоняющих сканов демона).
+    Без on_result возвращает список принятых постов; с on_result каждый принятый
+    пост сразу передаётся в await on_result(item) и в памяти не копится.
+    Сообщения читает пул сессий (client — его основная сессия) параллельно по
+    каналам; здесь они обрабатываются одним потоком, и только здесь пишется seen.
+    Каналы, которые не удалось дочитать, остаются в pool.failed.
+    """
+    now = datetime.utcnow()
+    channel_hours = channel_hours or {}
+    since = {ch: now - timedelta(hours=channel_hours.get(ch, hours)) for ch in CHANNELS}
     results = []
-
-    for ch in CHANNELS:
-        print(f"[scan_history] Сканируем {ch}…")
-        processed = 0
-        async for msg in client.iter_messages(entity=ch, limit=limit_per_channel):
-            if not msg:
-                continue
-            msg_date = getattr(msg, 'date', None)
-            if msg_date is not None:
-                msg_date = msg_date.replace(tzinfo=None)
-                if msg_date < since:
-                    break
-            text = msg.message or getattr(msg, 'caption', '') or ''
-            if not text:
-                continue
-
-            unique = f"{ch}::{text[:500]}"
-            cur = conn.execute("SELECT 1 FROM seen WHERE msg_unique=?", (unique,))
-            if cur.fetchone():
-                continue
-
-            res = score_and_classify(text, cfg)
+    processed = Counter()
+
+    print(f"[scan_history] Сканируем {len(CHANNELS)} каналов через {len(pool.sessions)} сесс.…")
+    async for ch, msg in pool.stream(CHANNELS, since, limit_per_channel):
+        text = msg.message or getattr(msg, 'caption', '') or ''
+        if not text:
+            continue
+
+        # по строке в seen на каждый профиль; уже виденные профили пропускаем
+        pending = []
+        for prof in PROFILES:
+            unique = unique_key(prof['name'], ch, text)
+            if not is_seen(conn, unique):
+                pending.append((prof, unique))
+        if not pending:
+            continue
+
+        # каскад: если все профили отсекли сообщение префильтром, текст не стеммится
+        # и токенов нет (tg_job_rescore.py достроит их из raw_text при необходимости)
+        scored, tokens = score_and_tokenize(text, [prof for prof, _ in pending])
+        tokens_blob = vocab.encode(tokens) if tokens is not None else None
+        tokens_ver = TOKENIZER_VERSION if tokens is not None else None
+        # текст и токены — только в первой из строк сообщения по профилям
+        # (остальные находят их по каналу и msg_id: db.message_text, tg_job_rescore.py)
+        raw_text = codec.pack(text)
+        accepted = []
+        for prof, unique in pending:
+            res = scored[prof['name']]
             final = res.get('final_score')
             summary = res.get('summary')
             pos_sum = res.get('positive_sum', 0)
@@ -166,13 +195,14 @@ async def scan_history(client: TelegramClient, hours: int = 24, limit_per_channe
 
             status = summary if final is not None else 'Отброшено'
             conn.execute(
-                "INSERT OR REPLACE INTO seen(msg_unique, channel, msg_id, status, score, pos_sum, neg_sum, matches, raw_text, first_seen_ts) VALUES(?,?,?,?,?,?,?,?,?,strftime('%s','now'))",
-                (unique, ch, msg.id, status, final if final is not None else None, pos_sum, neg_sum, json.dumps(matches, ensure_ascii=False), text)
+                "INSERT OR REPLACE INTO seen(msg_unique, profile, channel, msg_id, status, score, pos_sum, neg_sum, matches, raw_text, tokens, tokens_ver, first_seen_ts) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,strftime('%s','now'))",
+                (unique, prof['name'], ch, msg.id, status, final if final is not None else None, pos_sum, neg_sum, codec.pack(json.dumps(matches, ensure_ascii=False)), raw_text, tokens_blob, tokens_ver)
             )
-            conn.commit()
+            raw_text = tokens_blob = tokens_ver = None
 
             if final is not None and not summary.startswith('Точно нет'):
-                results.append({
+                accepted.append({
+                    'profile': prof['name'],
                     'channel': ch,
                     'msg_id': msg.id,
                     'final': final,
@@ -181,31 +211,71 @@ async def scan_history(client: TelegramClient, hours: int = 24, limit_per_channe
                     'summary': summary,
                     'preview': text[:800]
                 })
+        conn.commit()
+
+        # отдаём принятые посты только после commit, чтобы не потерять их при сбое отправки
+        if on_result is None:
+            results.extend(accepted)
+        else:
+            for item in accepted:
+                await on_result(item)
 
-            processed += 1
-        print(f"[scan_history] {ch} обработано ~{processed} сообщений")
+        processed[ch] += 1
+    for ch in CHANNELS:
+        print(f"[scan_history] {ch} обработано ~{processed[ch]} сообщений")
     return results
 
 
 # ================= 5.0 FETCH MESSAGES =================
 
-async def fetch_messages(hours: int = 24, batch_size: int = 5):
+async def fetch_messages(hours: float = 24, batch_size: int = 5, emit: str = None, notify_empty: bool = True,
+                         channel_hours: dict = None):
     """
     Запускает сканирование истории каналов за последние `hours` часов,
     записывает в БД (scan_history делает это) и после формирует/отправляет отчёт.
+
+    emit (по умолчанию cfg['scan']['emit'], иначе "batch"):
+    - "batch"  — собрать все посты и отправить после сканирования (как раньше);
+    - "stream" — отправлять посты по мере принятия, в памяти только счётчики;
+    - "digest" — в конце отправить только top_k лучших постов по рейтингу.
+    notify_empty=False — не писать в чат профиля, если для него ничего не нашлось
+    (плановые сканы демона).
+    channel_hours — окна отдельных каналов вместо hours (см. scan_history).
     """
-    print(f"[fetch_messages] Сканирование каналов за последние {hours} часов…")
+    emit = emit or SCAN_CFG.get("emit", "batch")
+    print(f"[fetch_messages] Сканирование каналов за последние {hours} часов… (режим {emit})")
+
+    if emit in ("stream", "digest"):
+        streams = {
+            prof['name']: ResultStream(
+                client, prof.get('target_chat_id') or TARGET_CHAT, mode=emit,
+                top_k=int(SCAN_CFG.get("top_k", 20)), pause_sec=2.0, notify_empty=notify_empty
+            )
+            for prof in PROFILES
+        }
+
+        async def on_result(item):
+            await streams[item['profile']].emit(item)
+
+        await scan_history(client, hours=hours, on_result=on_result, channel_hours=channel_hours)
+        for stream in streams.values():
+            await stream.finish()
+        return
+
     # scan_history должен вернуть список результатов с ожидаемыми полями
-    results = await scan_history(client, hours=hours)
+    results = await scan_history(client, hours=hours, channel_hours=channel_hours)
 
     if not results:
         print("[fetch_messages] Релевантных сообщений не найдено.")
-        # отправляем в чат уведомление о пустой выборке
-        await client.send_message(TARGET_CHAT, "Ничего релевантного за период не найдено.")
-        return
 
-    # вызов общей функции отправки/форматирования
-    await send_results(client, results, TARGET_CHAT, batch_size=batch_size, pause_sec=2.0)
+    # каждый профиль получает свою выборку в свой чат
+    # (send_results сам сообщит в чат о пустой выборке)
+    for prof in PROFILES:
+        chat = prof.get('target_chat_id') or TARGET_CHAT
+        prof_results = [r for r in results if r.get('profile') == prof['name']]
+        if not prof_results and not notify_empty:
+            continue
+        await send_results(client, prof_results, chat, batch_size=batch_size, pause_sec=2.0)
 
 
 """ async def send_results(client, results: list, target_chat_id, batch_size: int = 5, pause_sec: float = 2.0):
@@ -241,6 +311,32 @@ def _truncate_to_fit(block: str, limit: int = MESSAGE_LIMIT) -> str:
     # стараемся не резать середину эмодзи/UTF-8, но Python строка — безопасно
     return trunc + "\n…"
 
+async def _send_post(client, target_chat_id, item: dict):
+    """Отправляет один пост (с обрезкой под MESSAGE_LIMIT). Возвращает текст ошибки или None."""
+    block = format_post_block(item)  # используем вашу форматирующую функцию
+    # защищаем от слишком длинного блока
+    if len(block) > MESSAGE_LIMIT:
+        # попытаемся укоротить preview внутри item и пересобрать
+        preview = item.get("preview", "")
+        # оценка длины: сколько символов нужно убрать
+        excess = len(block) - MESSAGE_LIMIT + 100  # +100 запас
+        if preview and len(preview) > excess:
+            new_preview = preview[:-excess] + "…"
+            item_short = dict(item)
+            item_short["preview"] = new_preview
+            block = format_post_block(item_short)
+        else:
+            # тупо обрезаем строку
+            block = _truncate_to_fit(block, MESSAGE_LIMIT)
+
+    try:
+        await client.send_message(target_chat_id, block)
+    except Exception as e:
+        print(f"[send_results] Ошибка при отправке: {e}")
+        return str(e)
+    return None
+
+
 async def send_results(client, results: list, target_chat_id, batch_size=None, pause_sec: float = 1.2):
 
     """
@@ -280,31 +376,14 @@ async def send_results(client, results: list, target_chat_id, batch_size=None, p
 
     # Отправляем посты по одному — так проще контролировать длину и ошибки
     for idx, item in enumerate(results, start=1):
-        block = format_post_block(item)  # используем вашу форматирующую функцию
-        # защищаем от слишком длинного блока
-        if len(block) > MESSAGE_LIMIT:
-            # попытаемся укоротить preview внутри item и пересобрать
-            preview = item.get("preview", "")
-            # оценка длины: сколько символов нужно убрать
-            excess = len(block) - MESSAGE_LIMIT + 100  # +100 запас
-            if preview and len(preview) > excess:
-                new_preview = preview[:-excess] + "…"
-                item_short = dict(item)
-                item_short["preview"] = new_preview
-                block = format_post_block(item_short)
-            else:
-                # тупо обрезаем строку
-                block = _truncate_to_fit(block, MESSAGE_LIMIT)
-
-        try:
-            await client.send_message(target_chat_id, block)
+        err = await _send_post(client, target_chat_id, item)
+        if err is None:
             sent += 1
             if DEBUG:
                 print(f"[send_results] Sent {idx}/{total}")
-        except Exception as e:
+        else:
             failed += 1
-            failed_items.append((item.get("channel"), item.get("msg_id"), str(e)))
-            print(f"[send_results] Ошибка при отправке: {e}")
+            failed_items.append((item.get("channel"), item.get("msg_id"), err))
         # пауза между сообщениями
         await asyncio.sleep(pause_sec)
 
@@ -327,11 +406,124 @@ async def send_results(client, results: list, target_chat_id, batch_size=None, p
 
     print(f"[send_results] Отправлено {sent} из {total}, упало {failed}.")
 
+class TopK:
+    """k лучших постов по final с ограниченной памятью (min-heap размера k)."""
+
+    def __init__(self, k: int):
+        self.k = k
+        self._heap = []
+        self._seq = 0
+
+    def push(self, item: dict):
+        if self.k <= 0:
+            return
+        # при равном рейтинге вытесняется более поздний пост
+        self._seq += 1
+        entry = (item.get('final') or 0, -self._seq, item)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+
+    def items(self) -> list:
+        """Посты по убыванию рейтинга."""
+        return [e[2] for e in sorted(self._heap, key=lambda e: e[:2], reverse=True)]
+
+
+class ResultStream:
+    """
+    Потоковая отправка результатов в один чат.
+    Хранит только счётчики (и не более top_k постов в режиме "digest"):
+    - mode="stream": каждый пост отправляется сразу в emit();
+    - mode="digest": в finish() отправляются top_k лучших постов.
+    """
+
+    MAX_FAILED_ITEMS = 50  # сколько ошибок перечислить в финальном отчёте
+
+    def __init__(self, client, target_chat_id, mode: str = "stream", top_k: int = 20, pause_sec: float = 1.2,
+                 notify_empty: bool = True):
+        self.client = client
+        self.notify_empty = notify_empty
+        self.target_chat_id = target_chat_id
+        self.mode = mode
+        self.pause_sec = pause_sec
+        self.top = TopK(top_k) if mode == "digest" else None
+        self.started = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.total = 0
+        self.sent = 0
+        self.failed = 0
+        self.failed_items = []
+        self.counts_by_summary = Counter()
+
+    async def _send_text(self, text: str):
+        try:
+            await self.client.send_message(self.target_chat_id, text)
+        except Exception as e:
+            print(f"[ResultStream] Ошибка при отправке отчёта: {e}")
+
+    async def _send(self, item: dict):
+        err = await _send_post(self.client, self.target_chat_id, item)
+        if err is None:
+            self.sent += 1
+        else:
+            self.failed += 1
+            if len(self.failed_items) < self.MAX_FAILED_ITEMS:
+                self.failed_items.append((item.get("channel"), item.get("msg_id"), err))
+        await asyncio.sleep(self.pause_sec)
+
+    async def emit(self, item: dict):
+        self.total += 1
+        if self.total == 1 and self.top is None:
+            # заголовок — только когда есть что отправлять
+            await self._send_text(f"JobWatcher — потоковое сканирование\nНачато: {self.started}")
+        self.counts_by_summary[item.get("summary", "Нет метки")] += 1
+        if self.top is not None:
+            self.top.push(item)
+        else:
+            await self._send(item)
+
+    async def finish(self):
+        if self.total == 0:
+            if self.notify_empty:
+                await self._send_text("Ничего релевантного за период не найдено.")
+            print("[ResultStream] Нечего отправлять.")
+            return
+
+        if self.top is not None:
+            top_items = self.top.items()
+            await self._send_text(
+                f"JobWatcher — лучшие {len(top_items)} из {self.total} пост(ов)\nНачато: {self.started}"
+            )
+            for item in top_items:
+                await self._send(item)
+
+        final_lines = [
+            f"JobWatcher — итог отправки ({self.started})",
+            f"Всего найдено: {self.total}",
+            f"Отправлено: {self.sent}",
+            f"Не отправлено: {self.failed}",
+            "Распределение по итогам:"
+        ]
+        for k, v in self.counts_by_summary.items():
+            final_lines.append(f"  {k}: {v}")
+        if self.failed_items:
+            final_lines.append("\nСписок ошибок (канал, msg_id, ошибка):")
+            for ch, mid, err in self.failed_items:
+                final_lines.append(f" - {ch} {mid} — {err}")
+        await self._send_text("\n".join(final_lines))
+        print(f"[ResultStream] Отправлено {self.sent} из {self.total}, упало {self.failed}.")
+
+
 # ================= 6.0 MAIN =================
 async def main():
     await client.start(phone=PHONE)
+    await pool.start()
 
-    hours = input("За какой период сканировать? (в часах, например 24 / 72 / 168): ")
+    # период можно передать аргументом (python tg_job_scan.py 24), иначе спрашиваем
+    if len(sys.argv) > 1:
+        hours = sys.argv[1]
+    else:
+        hours = input("За какой период сканировать? (в часах, например 24 / 72 / 168): ")
     try:
         hours = int(hours)
     except:
@@ -342,6 +534,7 @@ async def main():
     await fetch_messages(hours)
     print("Готово.")
 
+    await pool.disconnect()
     await client.disconnect()
 
 if __name__ == "__main__":
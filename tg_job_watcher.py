@@ -2,13 +2,15 @@
 # Запуск: python tg_job_watcher.py
 
 import os
-import re
 import asyncio
-import sqlite3
 import json
 import yaml
 from dotenv import load_dotenv
 from telethon import TelegramClient, events, Button
+from telethon.errors import MessageNotModifiedError
+from score import get_profiles, score_and_tokenize, TOKENIZER_VERSION
+from db import init_db, is_seen, unique_key, StemVocab, TextCodec
+from peers import PeerCache, DEFAULT_TTL_SEC
 
 load_dotenv()
 
@@ -24,119 +26,46 @@ with open("config.yaml", "r", encoding="utf-8") as f:
     cfg = yaml.safe_load(f)
 
 CHANNELS = [c for c in cfg.get("channels", []) if c]
+PROFILES = get_profiles(cfg)
+
+# Клиент и БД создаются в setup(): демон (tg_job_daemon.py) передаёт свои общие,
+# чтобы сессия и jobwatcher.db открывались одним процессом один раз
+client = None
+conn = None
+vocab = None
+codec = None
+peer_cache = None
+
+
+def setup(shared_client=None, shared_conn=None, shared_vocab=None, shared_peer_cache=None, shared_codec=None,
+          target_chat=None):
+    """
+    Подключение к базе (создание таблицы, если нет), клиент и обработчик кнопок.
+    target_chat — чат по умолчанию вместо TARGET_CHAT: демон передаёт чат сканера,
+    чтобы живые уведомления и сканы приходили в одно место.
+    """
+    global client, conn, vocab, codec, peer_cache, TARGET_CHAT
+    if target_chat is not None:
+        TARGET_CHAT = target_chat
+    conn = shared_conn or init_db(DB_PATH)
+    vocab = shared_vocab or StemVocab(conn)
+    codec = shared_codec or TextCodec(conn, enabled=bool((cfg.get("storage") or {}).get("compress", True)))
+    peer_cache = shared_peer_cache or PeerCache(
+        conn, SESSION, ttl_sec=int(cfg.get("peer_cache_ttl_hours", DEFAULT_TTL_SEC // 3600)) * 3600
+    )
+    client = shared_client or TelegramClient(SESSION, API_ID, API_HASH)
+    client.add_event_handler(callback, events.CallbackQuery)
+    return client
 
-# Подключение к базе и создание таблицы (если нет)
-conn = sqlite3.connect(DB_PATH)
-conn.execute("""
-CREATE TABLE IF NOT EXISTS seen (
-    msg_unique TEXT PRIMARY KEY,
-    channel TEXT,
-    msg_id INTEGER,
-    status TEXT,
-    score INTEGER,
-    pos_sum INTEGER,
-    neg_sum INTEGER,
-    matches TEXT,
-    first_seen_ts INTEGER
-)
-""")
-conn.commit()
-
-client = TelegramClient(SESSION, API_ID, API_HASH)
-
-# Вспомогательные функции
-
-def find_sentences(text: str):
-    parts = re.split(r'[\n\.\!?;]+', text)
-    return [p.strip() for p in parts if p.strip()]
-
-
-def match_count_in_sentence(word: str, sentence: str) -> int:
-    pattern = r'\b' + re.escape(word.lower()) + r'\b'
-    return 1 if re.search(pattern, sentence.lower()) else 0
-
-
-def score_and_classify(text: str, cfg: dict):
-    text_low = (text or "").lower()
-    # Immediate ignore
-    for w in cfg.get("markers", {}).get("ignore_markers", []) or []:
-        if re.search(r'\b' + re.escape(w.lower()) + r'\b', text_low):
-            return {
-                'final_score': None,
-                'positive_sum': 0,
-                'negative_sum': 0,
-                'matches': {'ignore': [w]},
-                'summary': f"Точно нет (ignore: {w})"
-            }
-
-    sentences = find_sentences(text)
-    required_kw = [k.lower() for k in cfg.get("context_keywords", {}).get("required", []) or []]
-    desirable_kw = [k.lower() for k in cfg.get("context_keywords", {}).get("desirable", []) or []]
-
-    def sentence_multiplier(sentence: str) -> float:
-        s = sentence.lower()
-        for rk in required_kw:
-            if re.search(r'\b' + re.escape(rk) + r'\b', s):
-                return 1.8
-        for dk in desirable_kw:
-            if re.search(r'\b' + re.escape(dk) + r'\b', s):
-                return 0.6
-        return 1.0
-
-    matches = {'excellent': [], 'acceptable': [], 'negative': [], 'strong_negative': []}
-    positive_sum = 0.0
-    negative_sum = 0.0
-
-    for sent in sentences:
-        mult = sentence_multiplier(sent)
-        s = sent.lower()
-        for w in cfg.get("markers", {}).get("excellent_markers", []) or []:
-            if match_count_in_sentence(w, s):
-                val = 2 * mult
-                positive_sum += val
-                matches['excellent'].append((w, sent[:120]))
-        for w in cfg.get("markers", {}).get("acceptable_markers", []) or []:
-            if match_count_in_sentence(w, s):
-                val = 1 * mult
-                positive_sum += val
-                matches['acceptable'].append((w, sent[:120]))
-        for w in cfg.get("markers", {}).get("negative_markers", []) or []:
-            if match_count_in_sentence(w, s):
-                val = -1 * mult
-                negative_sum += val
-                matches['negative'].append((w, sent[:120]))
-        for w in cfg.get("markers", {}).get("strong_negative_markers", []) or []:
-            if match_count_in_sentence(w, s):
-                val = -2 * mult
-                negative_sum += val
-                matches['strong_negative'].append((w, sent[:120]))
-
-    positive_sum = int(round(positive_sum))
-    negative_sum = int(round(negative_sum))  # <= 0
-    final_score = positive_sum + negative_sum
-
-    thr = cfg.get("thresholds", {"target": 4, "alternative": 2, "maybe": 1})
-    if final_score is None:
-        summary = "Точно нет"
-    elif final_score >= thr.get("target", 4):
-        summary = "Хорошее совпадение" if negative_sum == 0 else "Хорошее, но есть минусы (противоречиво)"
-    elif final_score >= thr.get("alternative", 2):
-        summary = "Альтернативно — рассмотреть"
-    elif final_score >= thr.get("maybe", 1):
-        summary = "Похоже — надо вчитаться"
-    else:
-        summary = "Точно нет"
 
-    return {
-        'final_score': int(final_score),
-        'positive_sum': int(positive_sum),
-        'negative_sum': int(abs(negative_sum)),
-        'matches': matches,
-        'summary': summary
-    }
+async def start_watching():
+    """Разрешает CHANNELS через кэш peers и подписывает newmsg_handler (клиент уже запущен)."""
+    peers = await peer_cache.resolve_all(client, CHANNELS)
+    client.add_event_handler(newmsg_handler, events.NewMessage(chats=list(peers.values())))
+    print(f"Клиент запущен, каналов: {len(peers)}/{len(CHANNELS)}. Ожидание новых сообщений...")
 
 
-@client.on(events.NewMessage(chats=CHANNELS))
+# регистрируется в start_watching() после разрешения CHANNELS через кэш peers
 async def newmsg_handler(event):
     msg = event.message
     channel = getattr(event.chat, "username", getattr(event.chat, "title", str(event.chat)))
@@ -144,13 +73,26 @@ async def newmsg_handler(event):
     if msg.media and not text:
         text = getattr(msg, "caption", "") or ""
 
-    unique = f"{channel}::{(text[:500]).strip()}"
-    cur = conn.execute("SELECT 1 FROM seen WHERE msg_unique=?", (unique,))
-    if cur.fetchone():
+    pending = []
+    for prof in PROFILES:
+        unique = unique_key(prof['name'], channel, text)
+        if not is_seen(conn, unique):
+            pending.append((prof, unique))
+    if not pending:
         return
 
-    # используем новую функцию подсчёта
-    res = score_and_classify(text, cfg)
+    # один проход токенизации/поиска маркеров на все профили
+    # каскад: если все профили отсекли сообщение префильтром, текст не стеммится и токенов нет
+    scored, tokens = score_and_tokenize(text, [prof for prof, _ in pending])
+    tokens_blob = vocab.encode(tokens) if tokens is not None else None
+    tokens_ver = TOKENIZER_VERSION if tokens is not None else None
+    for prof, unique in pending:
+        await _handle_profile_result(prof, unique, channel, msg, text, tokens_blob, tokens_ver, scored[prof['name']])
+        # токены — только в первой из строк сообщения по профилям
+        tokens_blob = tokens_ver = None
+
+
+async def _handle_profile_result(prof, unique, channel, msg, text, tokens_blob, tokens_ver, res):
     final = res.get('final_score')            # число или None если ignore
     summary = res.get('summary', 'Без метки')
     pos_sum = res.get('positive_sum', 0)
@@ -161,71 +103,112 @@ async def newmsg_handler(event):
     if final is None or summary.startswith("Точно нет"):
         status = "Отброшено"
         conn.execute(
-            "INSERT OR REPLACE INTO seen(msg_unique, channel, msg_id, status, score, first_seen_ts) VALUES(?,?,?,?,?,strftime('%s','now'))",
-            (unique, channel, msg.id, status, None)
+            "INSERT OR REPLACE INTO seen(msg_unique, profile, channel, msg_id, status, score, tokens, tokens_ver, first_seen_ts) VALUES(?,?,?,?,?,?,?,?,strftime('%s','now'))",
+            (unique, prof['name'], channel, msg.id, status, None, tokens_blob, tokens_ver)
         )
         conn.commit()
         return
 
     # Иначе — сохраняем расширённую запись
     status = summary
-    matches_json = json.dumps(matches, ensure_ascii=False)
-    conn.execute(
-        "INSERT OR REPLACE INTO seen(msg_unique, channel, msg_id, status, score, pos_sum, neg_sum, matches, first_seen_ts) VALUES(?,?,?,?,?,?,?,?,strftime('%s','now'))",
-        (unique, channel, msg.id, status, final, pos_sum, neg_sum, matches_json)
-    )
+    matches_json = codec.pack(json.dumps(matches, ensure_ascii=False))
+    rowid = conn.execute(
+        "INSERT OR REPLACE INTO seen(msg_unique, profile, channel, msg_id, status, score, pos_sum, neg_sum, matches, tokens, tokens_ver, first_seen_ts) VALUES(?,?,?,?,?,?,?,?,?,?,?,strftime('%s','now'))",
+        (unique, prof['name'], channel, msg.id, status, final, pos_sum, neg_sum, matches_json, tokens_blob, tokens_ver)
+    ).lastrowid
     conn.commit()
 
     preview = text.strip()
     if len(preview) > 900:
         preview = preview[:900] + "…"
 
-    buttons = [
-        [Button.inline("Отклик", f"apply:{msg.id}:{channel}"), Button.inline("Пропустить", f"skip:{msg.id}:{channel}")],
-        [Button.inline("Сохранить", f"save:{msg.id}:{channel}")]
-    ]
-
     await client.send_message(
-        TARGET_CHAT,
+        prof.get('target_chat_id') or TARGET_CHAT,
         f"Источник: {channel}\nРейтинг: {final} (плюсы: +{pos_sum}, минусы: -{neg_sum})\nИтог: {status}\n\n{preview}",
-        buttons=buttons
+        buttons=_buttons(rowid)
     )
 
 
-@client.on(events.CallbackQuery)
+# Кнопки: payload "<cmd>:<rowid строки seen>" (несколько байт при лимите Telegram в 64),
+# запись находится по первичному ключу. Старые уведомления несут "apply:<msg_id>:<channel>".
+BUTTON_STATUS = {'a': 'Откликнулся', 's': 'Неинтересно', 'v': 'Сохранено'}
+LEGACY_CMD = {'apply': 'a', 'skip': 's', 'save': 'v'}
+
+# смены статуса копятся и пишутся в БД одним executemany раз в STATUS_FLUSH_SEC
+STATUS_FLUSH_SEC = 2.0
+_pending_status = {}
+_flush_task = None
+
+
+def _buttons(rowid: int, status: str = None):
+    def button(label, cmd):
+        mark = "✅ " if BUTTON_STATUS[cmd] == status else ""
+        return Button.inline(mark + label, f"{cmd}:{rowid}")
+    return [
+        [button("Отклик", 'a'), button("Пропустить", 's')],
+        [button("Сохранить", 'v')]
+    ]
+
+
+def flush_status():
+    """Записывает накопленные смены статуса (вызывается таймером и при остановке)."""
+    if not _pending_status:
+        return
+    updates = [(status, rowid) for rowid, status in _pending_status.items()]
+    _pending_status.clear()
+    conn.executemany("UPDATE seen SET status=? WHERE rowid=?", updates)
+    conn.commit()
+
+
+async def _flush_status_later():
+    await asyncio.sleep(STATUS_FLUSH_SEC)
+    flush_status()
+
+
+def _queue_status(rowid: int, status: str):
+    global _flush_task
+    _pending_status[rowid] = status
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.ensure_future(_flush_status_later())
+
+
+# регистрируется в setup()
 async def callback(event):
     data = event.data.decode('utf-8') if event.data else ""
-    await event.answer()
     parts = data.split(":", 2)
-    if len(parts) >= 3:
-        cmd, msg_id, channel = parts
+    if len(parts) == 2 and parts[0] in BUTTON_STATUS and parts[1].isdigit():
+        cmd, rowid = parts[0], int(parts[1])
+        row = conn.execute("SELECT 1 FROM seen WHERE rowid=?", (rowid,)).fetchone()
+    elif len(parts) == 3 and parts[0] in LEGACY_CMD and parts[1].isdigit():
+        cmd = LEGACY_CMD[parts[0]]
+        row = conn.execute("SELECT rowid FROM seen WHERE msg_id=? AND channel=?", (int(parts[1]), parts[2])).fetchone()
+        rowid = row[0] if row else None
     else:
+        await event.answer()
         return
 
-    cur = conn.execute("SELECT msg_unique FROM seen WHERE msg_id=?", (int(msg_id),))
-    row = cur.fetchone()
-    if row:
-        unique = row[0]
-        if cmd == "apply":
-            conn.execute("UPDATE seen SET status='Откликнулся' WHERE msg_unique=?", (unique,))
-            conn.commit()
-            await client.send_message(TARGET_CHAT, f"Отмечено как «Откликнулся» для сообщения {msg_id} в {channel}")
-        elif cmd == "skip":
-            conn.execute("UPDATE seen SET status='Неинтересно' WHERE msg_unique=?", (unique,))
-            conn.commit()
-            await client.send_message(TARGET_CHAT, f"Отмечено как «Неинтересно» для сообщения {msg_id}")
-        elif cmd == "save":
-            conn.execute("UPDATE seen SET status='Сохранено' WHERE msg_unique=?", (unique,))
-            conn.commit()
-            await client.send_message(TARGET_CHAT, f"Сохранено: сообщение {msg_id}")
-    else:
-        await client.send_message(TARGET_CHAT, "Не удалось найти запись в БД для этого сообщения.")
+    if not row:
+        await event.answer("Не удалось найти запись в БД для этого сообщения.", alert=True)
+        return
+
+    status = BUTTON_STATUS[cmd]
+    _queue_status(rowid, status)
+    await event.answer(f"Отмечено: {status}")
+    # отмечаем выбор на самих кнопках исходного уведомления вместо нового сообщения
+    try:
+        await event.edit(buttons=_buttons(rowid, status))
+    except MessageNotModifiedError:
+        pass
 
 
 async def main():
+    setup()
     await client.start()
-    print("Клиент запущен. Ожидание новых сообщений...")
-    await client.run_until_disconnected()
+    await start_watching()
+    try:
+        await client.run_until_disconnected()
+    finally:
+        flush_status()
 
 
 